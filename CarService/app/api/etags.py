@@ -0,0 +1,33 @@
+from hashlib import blake2b
+from typing import Any
+
+from app.api.schemas import CarSchema
+from app.core.enums import ImageSize
+
+
+def car_etag(car: CarSchema, url_window: int, size: ImageSize = ImageSize.original) -> str:
+    # Presigned URLs rotate with the URL cache window, so the window is a part of the representation
+    return f'"{car.id}.{car.version}.{url_window}.{size}"'
+
+
+def cars_etag(cars: list[CarSchema], url_window: int, size: ImageSize = ImageSize.original) -> str:
+    return _hashed_etag(url_window, size, *((car.id, car.version) for car in cars))
+
+
+def collection_etag(url_window: int, *state: Any) -> str:
+    return _hashed_etag(url_window, *state)
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+
+    # If-None-Match uses the weak comparison, so W/ prefixes are ignored
+    candidates = (candidate.strip().removeprefix('W/') for candidate in if_none_match.split(','))
+    return etag in candidates
+
+
+def _hashed_etag(*state: Any) -> str:
+    return f'"{blake2b(repr(state).encode(), digest_size=16).hexdigest()}"'
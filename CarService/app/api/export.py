@@ -0,0 +1,24 @@
+import csv
+from io import StringIO
+
+from app.api.schemas import CarSchema
+from app.core.enums import DataFormat
+
+MEDIA_TYPES = {
+    DataFormat.ndjson: 'application/x-ndjson',
+    DataFormat.csv: 'text/csv',
+}
+
+CSV_FIELDS = [name for name, field in CarSchema.model_fields.items() if not field.exclude]
+
+
+def serialize_cars(cars: list[CarSchema], export_format: DataFormat, with_header: bool = False) -> bytes:
+    if export_format is DataFormat.ndjson:
+        return ''.join(car.model_dump_json() + '\n' for car in cars).encode()
+
+    buffer = StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS)
+    if with_header:
+        writer.writeheader()
+    writer.writerows(car.model_dump(mode='json') for car in cars)
+    return buffer.getvalue().encode()
@@ -0,0 +1,74 @@
+import codecs
+import csv
+import json
+from io import TextIOWrapper
+from itertools import islice
+from pathlib import PurePath
+from typing import Any, Iterator
+
+from fastapi import UploadFile
+
+from app.core.enums import DataFormat
+from app.core.exceptions import CarCreationError
+
+EXTENSIONS = {
+    '.csv': DataFormat.csv,
+    '.ndjson': DataFormat.ndjson,
+    '.jsonl': DataFormat.ndjson,
+}
+
+ENCODING = 'utf-8-sig'
+READ_CHUNK_SIZE = 1024 * 1024
+
+CONTENT_TYPES = {
+    'text/csv': DataFormat.csv,
+    'application/x-ndjson': DataFormat.ndjson,
+    'application/jsonl': DataFormat.ndjson,
+}
+
+
+def detect_format(file: UploadFile) -> DataFormat:
+    suffix = PurePath(file.filename or '').suffix.lower()
+    data_format = EXTENSIONS.get(suffix) or CONTENT_TYPES.get(file.content_type)
+    if data_format is None:
+        raise CarCreationError(f'Cannot import {file.filename!r}, expected a CSV or NDJSON file', status_code=415)
+    return data_format
+
+
+def check_encoding(file: UploadFile):
+    """Decode the whole file once up front, so a bad byte is rejected before any row is imported."""
+    decoder = codecs.getincrementaldecoder(ENCODING)()
+    try:
+        while chunk := file.file.read(READ_CHUNK_SIZE):
+            decoder.decode(chunk)
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError as err:
+        raise CarCreationError(f'Cannot import {file.filename!r}, expected UTF-8 text, err={err}', status_code=415)
+    file.file.seek(0)
+
+
+def read_rows(file: UploadFile) -> Iterator[tuple[int, dict[str, Any] | ValueError]]:
+    """Yield (row number, row) pairs, a row that cannot be parsed is yielded as the error instead."""
+    data_format = detect_format(file)
+    check_encoding(file)
+    stream = TextIOWrapper(file.file, encoding=ENCODING, newline='')
+
+    if data_format is DataFormat.csv:
+        for number, row in enumerate(csv.DictReader(stream), start=1):
+            yield number, {key: value if value != '' else None for key, value in row.items()}
+        return
+
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as err:
+            yield number, err
+            continue
+        yield number, row if isinstance(row, dict) else ValueError('Row must be a JSON object')
+
+
+def batched(rows: Iterator, size: int) -> Iterator[list]:
+    while batch := list(islice(rows, size)):
+        yield batch
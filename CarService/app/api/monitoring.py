@@ -0,0 +1,28 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+
+from app.car_app.cache import CarCache, get_car_cache
+from app.car_app.quotes import get_pricing_snapshot, PricingSnapshot
+from app.core.database import pool_statuses
+from app.core.metrics import REGISTRY
+from app.core.singleflight import get_single_flight, SingleFlight
+from app.storage.s3 import get_s3, S3Manager
+
+router = APIRouter(tags=['Monitoring'])
+
+
+@router.get('/metrics', response_class=PlainTextResponse)
+async def export_metrics(
+    s3: S3Manager = Depends(get_s3),
+    car_cache: CarCache = Depends(get_car_cache),
+    flights: SingleFlight = Depends(get_single_flight),
+    pricing_snapshot: PricingSnapshot = Depends(get_pricing_snapshot),
+):
+    stats = {
+        **pool_statuses(),
+        's3_presigned_url_cache': s3.url_cache.stats(),
+        'car_cache': car_cache.stats(),
+        'single_flight': flights.stats(),
+        'pricing_snapshot': pricing_snapshot.stats(),
+    }
+    return PlainTextResponse(REGISTRY.render(stats), media_type='text/plain; version=0.0.4')
@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import ORJSONResponse
+
+from app.api.schemas import QuoteRequestSchema, QuoteSchema
+from app.api.services import QuoteService
+from app.core.exceptions import QuoteError
+
+router = APIRouter(tags=['Quote'])
+
+
+@router.post('/quotes', response_model=QuoteSchema)
+async def create_quotes(quote_schema: QuoteRequestSchema, quote_service: QuoteService = Depends()):
+    """Prices of many cars, given by ids or by filters, for many rental windows.
+
+    A price is `cost_per_hour` times the billed hours, scaled by the multipliers of the car category and age and
+    reduced by the discount of the rental duration.
+    """
+    try:
+        quote = await quote_service.quote(quote_schema)
+    except QuoteError as err:
+        raise HTTPException(status_code=err.status_code, detail=str(err))
+
+    return ORJSONResponse(quote)
@@ -1,25 +1,137 @@
-from fastapi import APIRouter, Depends, File, HTTPException, Query, Response, UploadFile
-
-from app.api.schemas import CarCreatingSchema, CarSchema, CarUpdatingSchema, StatusUpdateSchema
+from fastapi import APIRouter, Depends, File, Header, HTTPException, Query, Request, Response, UploadFile
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+from app.api.export import MEDIA_TYPES
+from app.api.schemas import (
+    CarBatchResultSchema,
+    CarBatchSchema,
+    CarCreatingSchema,
+    CarFilterSchema,
+    CarPageSchema,
+    CarSchema,
+    CarUpdatingSchema,
+    ImportReportSchema,
+    StatusUpdateResultSchema,
+    StatusUpdateSchema,
+)
 from app.api.services import CarService
-from app.core.exceptions import CarCreationError, CarDeletingError, CarGettingError, CarUpdateError
+from app.car_app.events import CarEventFilter
+from app.core.enums import CarSorting, CarStatuse, DataFormat, ImageSize
+from app.core.exceptions import (
+    CarCreationError,
+    CarDeletingError,
+    CarGettingError,
+    CarUpdateError,
+    NotModifiedError,
+    PartialUpdateError,
+)
+from app.core.metrics import timed_phase
 
 router = APIRouter(tags=['Car'])
 
+# POST routes that only read, so they may be served by a replica
+READ_ONLY_PATHS = {'/cars/batch'}
+
 
-@router.get('/cars', response_model=list[CarSchema])
-async def retrieve_cars(car_service: CarService = Depends()):
-    return await car_service.get_cars()
+def _json_response(content: BaseModel | list[BaseModel], etag: str | None = None) -> ORJSONResponse:
+    # Returning a response skips validating the already trusted cars against `response_model` once more
+    headers = {'ETag': etag} if etag is not None else None
+    with timed_phase('serialize'):
+        if isinstance(content, list):
+            return ORJSONResponse([item.model_dump() for item in content], headers=headers)
+        return ORJSONResponse(content.model_dump(), headers=headers)
+
+
+@router.get('/cars', response_model=CarPageSchema)
+async def retrieve_cars(
+    filters: CarFilterSchema = Depends(CarFilterSchema.as_query),
+    sorting: CarSorting = Query(CarSorting.id_asc),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: str | None = Query(None),
+    size: ImageSize = Query(ImageSize.original),
+    if_none_match: str | None = Header(None),
+    car_service: CarService = Depends(),
+):
+    try:
+        page, etag = await car_service.get_cars(filters, sorting, limit, cursor, size, if_none_match)
+    except NotModifiedError as err:
+        return Response(status_code=err.status_code, headers={'ETag': err.etag})
+    except CarGettingError as err:
+        raise HTTPException(status_code=err.status_code, detail=str(err))
+
+    return _json_response(page, etag)
+
+
+@router.get('/cars/export', response_class=StreamingResponse)
+async def export_cars(
+    filters: CarFilterSchema = Depends(CarFilterSchema.as_query),
+    export_format: DataFormat = Query(DataFormat.ndjson, alias='format'),
+    car_service: CarService = Depends(),
+):
+    return StreamingResponse(
+        car_service.export_cars(filters, export_format),
+        media_type=MEDIA_TYPES[export_format],
+        headers={'Content-Disposition': f'attachment; filename="cars.{export_format}"'},
+    )
+
+
+@router.get('/cars/events', response_class=StreamingResponse)
+async def stream_car_events(
+    station_id: int | None = Query(None),
+    status: CarStatuse | None = Query(None),
+    last_event_id: int | None = Header(None),
+    car_service: CarService = Depends(),
+):
+    """Server-Sent Events of created, updated and deleted cars, optionally of a single station or status.
+
+    A client reconnecting with `Last-Event-ID` first gets the events it missed, as long as they are younger than
+    `CAR_EVENTS_RETENTION` seconds. A client that stops reading is disconnected and has to reconnect the same way.
+    """
+    return StreamingResponse(
+        car_service.stream_car_events(CarEventFilter(station_id, status), last_event_id),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@router.get('/cars/search', response_model=CarPageSchema)
+async def search_cars(
+    q: str = Query(min_length=1, max_length=64, description='Part of a car number or words of its description'),
+    filters: CarFilterSchema = Depends(CarFilterSchema.as_query),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = Query(None),
+    size: ImageSize = Query(ImageSize.original),
+    car_service: CarService = Depends(),
+):
+    """Cars whose number contains `q` or whose description has words close to it, the closest matches first.
+
+    Typo tolerance and ranking need the pg_trgm extension of Postgres. Without it, cars whose number or description
+    contains `q` are returned in the order of their ids.
+    """
+    try:
+        page = await car_service.search_cars(q, filters, limit, cursor, size)
+    except CarGettingError as err:
+        raise HTTPException(status_code=err.status_code, detail=str(err))
+
+    return _json_response(page)
 
 
 @router.get('/cars/{car_id}', response_model=CarSchema)
-async def retrieve_car(car_id: int, car_service: CarService = Depends()):
+async def retrieve_car(
+    car_id: int,
+    size: ImageSize = Query(ImageSize.original),
+    if_none_match: str | None = Header(None),
+    car_service: CarService = Depends(),
+):
     try:
-        car = await car_service.get_car(car_id)
+        car, etag = await car_service.get_car(car_id, size, if_none_match)
+    except NotModifiedError as err:
+        return Response(status_code=err.status_code, headers={'ETag': err.etag})
     except CarGettingError as err:
         raise HTTPException(status_code=err.status_code, detail=str(err))
 
-    return car
+    return _json_response(car, etag)
 
 
 @router.post('/cars', response_model=CarSchema)
@@ -36,6 +148,20 @@ async def add_car(
     return created_car
 
 
+@router.post('/cars/import', response_model=ImportReportSchema)
+async def import_cars(
+    file: UploadFile = File(),
+    images: UploadFile | None = File(None),
+    car_service: CarService = Depends(),
+):
+    try:
+        report = await car_service.import_cars(file, images)
+    except CarCreationError as err:
+        raise HTTPException(status_code=err.status_code, detail=str(err))
+
+    return report
+
+
 @router.put('/cars/{car_id}', response_model=CarSchema)
 async def upgrade_car(
     car_id: int,
@@ -51,6 +177,25 @@ async def upgrade_car(
     return updated_car
 
 
+@router.put('/cars/{car_id}/image', response_model=CarSchema)
+async def upload_car_image(
+    car_id: int,
+    request: Request,
+    file_name: str = Query(),
+    content_type: str = Header(),
+    content_length: int | None = Header(None),
+    car_service: CarService = Depends(),
+):
+    try:
+        updated_car = await car_service.replace_car_image(
+            car_id, request.stream(), file_name, content_type, content_length
+        )
+    except CarUpdateError as err:
+        raise HTTPException(status_code=err.status_code, detail=str(err))
+
+    return updated_car
+
+
 @router.delete('/cars/{car_id}', status_code=204, response_class=Response)
 async def remove_car(car_id: int, car_service: CarService = Depends()):
     try:
@@ -60,20 +205,49 @@ async def remove_car(car_id: int, car_service: CarService = Depends()):
 
 
 @router.get('/batch-cars', response_model=list[CarSchema])
-async def retrieve_batch_cars(car_ids: list[int] = Query(), car_service: CarService = Depends()):
+async def retrieve_batch_cars(
+    car_ids: list[int] = Query(),
+    size: ImageSize = Query(ImageSize.original),
+    if_none_match: str | None = Header(None),
+    car_service: CarService = Depends(),
+):
     try:
-        cars = await car_service.get_cars_by_ids(car_ids)
+        cars, etag = await car_service.get_cars_by_ids(car_ids, size, if_none_match)
+    except NotModifiedError as err:
+        return Response(status_code=err.status_code, headers={'ETag': err.etag})
     except CarGettingError as err:
         raise HTTPException(status_code=err.status_code, detail=str(err))
 
-    return cars
+    return _json_response(cars, etag)
 
 
-@router.post('/update-cars-status', response_model=list[CarSchema])
-async def update_cars(status_schema: StatusUpdateSchema, car_service: CarService = Depends()):
+@router.post('/cars/batch', response_model=CarBatchResultSchema)
+async def retrieve_cars_batch(
+    batch_schema: CarBatchSchema,
+    size: ImageSize = Query(ImageSize.original),
+    car_service: CarService = Depends(),
+):
     try:
-        created_cars = await car_service.update_cars_status(status_schema)
-    except CarCreationError as err:
+        result = await car_service.get_cars_batch(batch_schema.car_ids, size)
+    except CarGettingError as err:
+        raise HTTPException(status_code=err.status_code, detail=str(err))
+
+    return _json_response(result)
+
+
+@router.post('/update-cars-status', response_model=list[CarSchema] | StatusUpdateResultSchema)
+async def update_cars(
+    status_schema: StatusUpdateSchema,
+    brief: bool = Query(False, description='Return only ids, statuses and versions of updated cars'),
+    car_service: CarService = Depends(),
+):
+    try:
+        if brief:
+            return await car_service.update_cars_status_brief(status_schema)
+        updated_cars = await car_service.update_cars_status(status_schema)
+    except PartialUpdateError as err:
+        raise HTTPException(status_code=err.status_code, detail={'message': str(err), 'updated_ids': err.updated_ids})
+    except CarUpdateError as err:
         raise HTTPException(status_code=err.status_code, detail=str(err))
 
-    return created_cars
+    return updated_cars
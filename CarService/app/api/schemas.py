@@ -1,9 +1,9 @@
 from datetime import datetime
 
-from fastapi import Form
-from pydantic import BaseModel, ConfigDict, field_validator, PositiveFloat
+from fastapi import Form, Query
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator, PositiveFloat
 
-from app.core.enums import Brand, CarStatuse, Category, Color, FuelType, Transmission
+from app.core.enums import Brand, CarStatuse, Category, Color, FuelType, ImageSize, Transmission
 
 
 class BaseCarSchema(BaseModel):
@@ -62,6 +62,8 @@ class BaseCarSchema(BaseModel):
 class CarSchema(BaseCarSchema):
     id: int
     image: str | None = None
+    image_variants: dict[ImageSize, str] = Field({}, exclude=True)
+    version: int
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -74,6 +76,121 @@ class CarUpdatingSchema(BaseCarSchema):
     pass
 
 
+class CarPageSchema(BaseModel):
+    items: list[CarSchema]
+    next_cursor: str | None = None
+
+
+class CarFilterSchema(BaseModel):
+    status: CarStatuse | None = None
+    station_id: int | None = None
+    brand: Brand | None = None
+    category: Category | None = None
+    fuel_type: FuelType | None = None
+    min_cost_per_hour: PositiveFloat | None = None
+    max_cost_per_hour: PositiveFloat | None = None
+    year: int | None = None
+
+    @classmethod
+    def as_query(
+        cls,
+        status: CarStatuse | None = Query(None),
+        station_id: int | None = Query(None),
+        brand: Brand | None = Query(None),
+        category: Category | None = Query(None),
+        fuel_type: FuelType | None = Query(None),
+        min_cost_per_hour: PositiveFloat | None = Query(None),
+        max_cost_per_hour: PositiveFloat | None = Query(None),
+        year: int | None = Query(None),
+    ) -> 'CarFilterSchema':
+        return cls(
+            status=status,
+            station_id=station_id,
+            brand=brand,
+            category=category,
+            fuel_type=fuel_type,
+            min_cost_per_hour=min_cost_per_hour,
+            max_cost_per_hour=max_cost_per_hour,
+            year=year,
+        )
+
+
+class CarBatchSchema(BaseModel):
+    car_ids: list[int] = Field(min_length=1, description='Ids of the cars, repeated ids are returned once')
+
+
+class CarBatchResultSchema(BaseModel):
+    items: list[CarSchema]
+    missing_ids: list[int]
+
+
+class StationSummarySchema(BaseModel):
+    station_id: int
+    total: int
+    statuses: dict[CarStatuse, int]
+    categories: dict[Category, dict[CarStatuse, int]] = Field(description='Car counts by status per category')
+
+
+class RentalWindowSchema(BaseModel):
+    start: datetime
+    end: datetime
+
+    @model_validator(mode='after')
+    def ends_after_start(self) -> 'RentalWindowSchema':
+        if self.end <= self.start:
+            raise ValueError('Rental must end after it starts')
+        return self
+
+
+class QuoteRequestSchema(BaseModel):
+    car_ids: list[int] | None = Field(None, min_length=1, description='Ids of the cars, repeated ids are quoted once')
+    filters: CarFilterSchema | None = Field(None, description='Quote every car matching the filters instead')
+    windows: list[RentalWindowSchema] = Field(min_length=1, max_length=1000)
+
+    @model_validator(mode='after')
+    def cars_given_once(self) -> 'QuoteRequestSchema':
+        if (self.car_ids is None) == (self.filters is None):
+            raise ValueError('Either car_ids or filters must be given')
+        return self
+
+
+class QuoteWindowSchema(RentalWindowSchema):
+    hours: int = Field(description='Billed hours, every started hour counts')
+    discount: float
+
+
+class QuoteSchema(BaseModel):
+    car_ids: list[int]
+    windows: list[QuoteWindowSchema]
+    prices: list[list[float]] = Field(description='Price of every car for every window, a row per car of car_ids')
+    missing_ids: list[int]
+
+
+class ImportErrorSchema(BaseModel):
+    row: int
+    number: str | None = None
+    detail: str
+
+
+class ImportReportSchema(BaseModel):
+    created: list[int] = []
+    errors: list[ImportErrorSchema] = []
+
+
 class StatusUpdateSchema(BaseModel):
     status: CarStatuse
     car_ids: list[int]
+    versions: dict[int, int] = Field({}, description='Expected current version by car id, stale cars are skipped')
+
+
+class CarStatusSchema(BaseModel):
+    id: int
+    status: CarStatuse
+    version: int
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class StatusUpdateResultSchema(BaseModel):
+    updated: list[CarStatusSchema]
+    skipped: list[int]
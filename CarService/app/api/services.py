@@ -1,97 +1,529 @@
-from asyncio import gather
+from asyncio import gather, Semaphore
+from io import BytesIO
+from mimetypes import guess_type
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable, TypeVar
+from zipfile import BadZipFile, ZipFile
 
+import numpy as np
+import orjson
 from fastapi import Depends, UploadFile
+from pydantic import ValidationError
 
-from app.api.schemas import CarCreatingSchema, CarSchema, CarUpdatingSchema, StatusUpdateSchema
+from app.api.etags import car_etag, cars_etag, collection_etag, etag_matches
+from app.api.export import serialize_cars
+from app.api.imports import batched, read_rows
+from app.api.schemas import (
+    CarBatchResultSchema,
+    CarCreatingSchema,
+    CarFilterSchema,
+    CarPageSchema,
+    CarSchema,
+    CarUpdatingSchema,
+    ImportErrorSchema,
+    ImportReportSchema,
+    QuoteRequestSchema,
+    StationSummarySchema,
+    StatusUpdateResultSchema,
+    StatusUpdateSchema,
+)
+from app.car_app.cache import get_car_cache
+from app.car_app.events import CarEventFilter, get_car_event_hub
+from app.car_app.quotes import (
+    duration_discounts,
+    get_pricing_rules,
+    get_pricing_snapshot,
+    PricingRules,
+    PricingSnapshot,
+    quote_prices,
+    rental_hours,
+)
 from app.car_app.repository import CarRepository
-from app.core.exceptions import CarCreationError, CarDeletingError, CarGettingError, CarUpdateError, UploadFileError
+from app.car_app.stations import empty_summary, StationRepository
+from app.core.config import get_settings
+from app.core.database import managed_session
+from app.core.enums import CarSorting, DataFormat, ImageSize
+from app.core.exceptions import (
+    CarCreationError,
+    CarGettingError,
+    CarUpdateError,
+    NotModifiedError,
+    QuoteError,
+    UploadFileError,
+)
+from app.core.replicas import reads_from_primary
+from app.core.singleflight import get_single_flight, SingleFlight
+from app.storage.images import create_variants, variant_keys
 from app.storage.s3 import get_s3, S3Manager
+from app.storage.uploads import LimitedStream
 
 IMAGE_NAME = '{car_number}_{file_name}'
+CONFLICT = 'Conflicts with an existing car number or image'
+
+T = TypeVar('T')
 
 
 class CarService:
-    def __init__(self, repository: CarRepository = Depends(), s3: S3Manager = Depends(get_s3)):
+    def __init__(
+        self,
+        repository: CarRepository = Depends(),
+        s3: S3Manager = Depends(get_s3),
+        flights: SingleFlight = Depends(get_single_flight),
+    ):
         self.repository = repository
         self.s3 = s3
+        self.flights = flights
 
-    async def get_cars(self) -> list[CarSchema]:
-        cars = await self.repository.get_all()
-        cars = await self._set_image_url(cars)
-        return cars
+    async def get_cars(
+        self,
+        filters: CarFilterSchema,
+        sorting: CarSorting,
+        limit: int,
+        cursor: str | None = None,
+        size: ImageSize = ImageSize.original,
+        if_none_match: str | None = None,
+    ) -> tuple[CarPageSchema, str]:
+        filters_key = filters.model_dump_json()
+        count, last_modified = await self._read_once(
+            ('cars_state', filters_key), lambda repository: repository.get_state(filters)
+        )
+        etag = collection_etag(self._url_window(), filters, sorting, limit, cursor, size, count, last_modified)
+        if etag_matches(if_none_match, etag):
+            raise NotModifiedError(etag)
+
+        async def read_page(repository: CarRepository) -> CarPageSchema:
+            page = await repository.get_page(filters, sorting, limit, cursor)
+            page.items = await self._set_image_url(page.items, size)
+            return page
+
+        page = await self._read_once(
+            ('cars_page', filters_key, sorting, limit, cursor, size),
+            read_page,
+            lambda page: page.model_copy(update={'items': [car.model_copy() for car in page.items]}),
+        )
+        return page, etag
+
+    async def search_cars(
+        self,
+        q: str,
+        filters: CarFilterSchema,
+        limit: int,
+        cursor: str | None = None,
+        size: ImageSize = ImageSize.original,
+    ) -> CarPageSchema:
+        q = ' '.join(q.split())
+        min_length = get_settings().SEARCH_MIN_LENGTH
+        if len(q) < min_length:
+            # Shorter terms have no trigrams to look up, so the indexes could not narrow them down
+            raise CarGettingError(f'Search term must have at least {min_length} characters, got {q!r}', 422)
+
+        async def read_page(repository: CarRepository) -> CarPageSchema:
+            page = await repository.search(q, filters, limit, cursor)
+            page.items = await self._set_image_url(page.items, size)
+            return page
+
+        return await self._read_once(
+            ('cars_search', q, filters.model_dump_json(), limit, cursor, size),
+            read_page,
+            lambda page: page.model_copy(update={'items': [car.model_copy() for car in page.items]}),
+        )
+
+    async def export_cars(self, filters: CarFilterSchema, export_format: DataFormat) -> AsyncIterator[bytes]:
+        settings = get_settings()
+        with_header = True
+
+        # The request session is closed before a streaming response is sent, so the export owns its own
+        async with managed_session(read_only=True) as session:
+            repository = CarRepository(session, get_car_cache(), session)
+            async for cars in repository.stream(filters, settings.EXPORT_BATCH_SIZE):
+                for start in range(0, len(cars), settings.EXPORT_PRESIGN_CONCURRENCY):
+                    await self._set_image_url(cars[start : start + settings.EXPORT_PRESIGN_CONCURRENCY])
+
+                yield serialize_cars(cars, export_format, with_header)
+                with_header = False
+
+    @staticmethod
+    async def stream_car_events(event_filter: CarEventFilter, last_event_id: int | None = None) -> AsyncIterator[bytes]:
+        async for event in get_car_event_hub().subscribe(event_filter, last_event_id):
+            if event is None:
+                # A comment keeps proxies from closing the idle connection and tells a gone client from a quiet one
+                yield b': heartbeat\n\n'
+                continue
+            yield b'id: %d\nevent: car\ndata: %b\n\n' % (event['id'], orjson.dumps(event))
 
-    async def get_car(self, car_id: int) -> CarSchema:
-        car = await self.repository.get_by_id(car_id)
-        car.image = await self.s3.create_presigned_url(car.image)
-        return car
+    async def get_car(
+        self, car_id: int, size: ImageSize = ImageSize.original, if_none_match: str | None = None
+    ) -> tuple[CarSchema, str]:
+        car = await self._read_once(
+            ('car', car_id), lambda repository: repository.get_by_id(car_id), lambda car: car.model_copy()
+        )
+
+        etag = car_etag(car, self._url_window(), size)
+        if etag_matches(if_none_match, etag):
+            raise NotModifiedError(etag)
+
+        # Presigned only once a body is sent, a conditional request that matches never needs the URL
+        car.image = await self.s3.create_presigned_url(self._image_key(car, size))
+        return car, etag
 
     async def create_car(self, creating_schema: CarCreatingSchema, image: UploadFile) -> CarSchema:
+        try:
+            self._check_image(image.content_type, image.size)
+        except UploadFileError as err:
+            raise CarCreationError(err.message, err.status_code)
+
         file_name = IMAGE_NAME.format(car_number=creating_schema.number, file_name=image.filename)
+        await self.repository.claim_keys([file_name, *variant_keys(file_name).values()])
 
-        uploaded = await self.s3.upload_file(image, file_name)
+        try:
+            image_variants = await self._upload_variants(image, file_name)
+        except UploadFileError as err:
+            raise CarCreationError(err.message, err.status_code)
+
+        uploaded = await self.s3.upload_file(image, file_name, image.content_type)
         if uploaded is False:
             raise CarCreationError('Cannot update car image', status_code=520)
 
-        created_car = await self.repository.create(creating_schema, file_name)
+        created_car = await self.repository.create(creating_schema, file_name, image_variants)
         created_car.image = await self.s3.create_presigned_url(file_name)
 
         return created_car
 
+    async def import_cars(self, file: UploadFile, images: UploadFile | None = None) -> ImportReportSchema:
+        try:
+            archive = ZipFile(images.file) if images else None
+        except BadZipFile as err:
+            raise CarCreationError(f'Cannot read images archive {images.filename!r}, err={err}', status_code=400)
+        members = set(archive.namelist()) if archive else set()
+
+        report = ImportReportSchema()
+        numbers = set()
+        for batch in batched(read_rows(file), get_settings().IMPORT_BATCH_SIZE):
+            cars = []
+            for row_number, row in batch:
+                if isinstance(row, ValueError):
+                    report.errors.append(ImportErrorSchema(row=row_number, detail=f'Cannot parse row, err={row}'))
+                    continue
+
+                try:
+                    creating_schema = CarCreatingSchema.model_validate(row)
+                except ValidationError as err:
+                    detail = '; '.join(f'{".".join(map(str, error["loc"]))}: {error["msg"]}' for error in err.errors())
+                    number = row.get('number')
+                    report.errors.append(
+                        ImportErrorSchema(
+                            row=row_number, number=str(number) if number is not None else None, detail=detail
+                        )
+                    )
+                    continue
+
+                member = row.get('image')
+                if creating_schema.number in numbers:
+                    detail = 'Duplicate number in the imported file'
+                elif member is not None and not isinstance(member, str):
+                    detail = f'Image must be a name in the images archive, got {member!r}'
+                elif member is not None and member not in members:
+                    detail = f'Image {member!r} is not in the images archive'
+                elif member is not None and (error := self._check_member(archive, member)) is not None:
+                    detail = error
+                else:
+                    numbers.add(creating_schema.number)
+                    cars.append((row_number, creating_schema, member))
+                    continue
+                report.errors.append(ImportErrorSchema(row=row_number, number=creating_schema.number, detail=detail))
+
+            await self._import_batch(cars, archive, report)
+
+        report.errors.sort(key=lambda error: error.row)
+        return report
+
+    def _check_member(self, archive: ZipFile, member: str) -> str | None:
+        """The limits of a single uploaded image, with the content type guessed from the name of the member."""
+        try:
+            self._check_image(guess_type(member)[0], archive.getinfo(member).file_size)
+        except UploadFileError as err:
+            return f'{err.message}, in {member!r}'
+        return None
+
+    async def _import_batch(
+        self, cars: list[tuple[int, CarCreatingSchema, str | None]], archive: ZipFile | None, report: ImportReportSchema
+    ):
+        semaphore = Semaphore(get_settings().IMPORT_UPLOAD_CONCURRENCY)
+
+        # An upload would overwrite the image of an existing car, re-running an import must not touch its keys
+        keys = {
+            creating_schema.number: IMAGE_NAME.format(car_number=creating_schema.number, file_name=member)
+            for _, creating_schema, member in cars
+            if member is not None
+        }
+        taken_numbers, taken_keys = await self.repository.find_taken(
+            [creating_schema.number for _, creating_schema, _ in cars], list(keys.values())
+        )
+        free_cars = []
+        for row_number, creating_schema, member in cars:
+            if creating_schema.number in taken_numbers or keys.get(creating_schema.number) in taken_keys:
+                report.errors.append(ImportErrorSchema(row=row_number, number=creating_schema.number, detail=CONFLICT))
+                continue
+            free_cars.append((row_number, creating_schema, member))
+        cars = free_cars
+        await self.repository.claim_keys([keys[car.number] for _, car, _ in cars if car.number in keys])
+
+        async def upload(number: str, member: str | None) -> str | None:
+            if member is None:
+                return None
+
+            file_name = keys[number]
+            async with semaphore:
+                uploaded = await self.s3.upload_file(
+                    UploadFile(BytesIO(archive.read(member)), filename=member), file_name, guess_type(member)[0]
+                )
+            return file_name if uploaded else False
+
+        file_names = await gather(*(upload(creating_schema.number, member) for _, creating_schema, member in cars))
+
+        uploaded_cars = []
+        for (row_number, creating_schema, _), file_name in zip(cars, file_names):
+            if file_name is False:
+                report.errors.append(
+                    ImportErrorSchema(row=row_number, number=creating_schema.number, detail='Cannot upload car image')
+                )
+                continue
+            uploaded_cars.append((row_number, creating_schema, file_name))
+
+        created = await self.repository.bulk_create([(car, file_name) for _, car, file_name in uploaded_cars])
+
+        orphaned_keys = []
+        for row_number, creating_schema, file_name in uploaded_cars:
+            if creating_schema.number in created:
+                report.created.append(created[creating_schema.number])
+                continue
+
+            report.errors.append(ImportErrorSchema(row=row_number, number=creating_schema.number, detail=CONFLICT))
+            if file_name is not None:
+                orphaned_keys.append(file_name)
+
+        # A car created since the check may own the key by now, its image must stay
+        _, owned_keys = await self.repository.find_taken([], orphaned_keys)
+        await self.repository.enqueue_deletions([key for key in orphaned_keys if key not in owned_keys])
+
     async def update_car(self, car_id: int, updating_schema: CarUpdatingSchema, image: UploadFile) -> CarSchema:
         try:
-            file_name = await self._upload_file(car_id, image)
+            file_name, image_variants = await self._upload_file(car_id, image)
         except UploadFileError as err:
             raise CarUpdateError(err.message, err.status_code)
 
-        updated_car = await self.repository.update(car_id, updating_schema, file_name)
+        updated_car = await self.repository.update(car_id, updating_schema, file_name, image_variants)
         updated_car.image = await self.s3.create_presigned_url(file_name)
 
         return updated_car
 
-    async def _upload_file(self, car_id: int, image: UploadFile) -> str:
+    async def _upload_file(self, car_id: int, image: UploadFile) -> tuple[str, dict[ImageSize, str] | None]:
         try:
             old_car = await self.repository.get_by_id(car_id)
         except CarGettingError as err:
             raise UploadFileError(err.message, err.status_code)
         file_name = old_car.image
+        image_variants = None
 
         if image:
-            deleted = await self.s3.delete_objects(file_name)
-            if deleted is False:
-                raise UploadFileError('Cannot delete car image', status_code=520)
-
+            self._check_image(image.content_type, image.size)
             file_name = IMAGE_NAME.format(car_number=old_car.number, file_name=image.filename)
-            uploaded = await self.s3.upload_file(image, file_name)
+            await self.repository.claim_keys([file_name, *variant_keys(file_name).values()])
+            image_variants = await self._upload_variants(image, file_name)
+
+            uploaded = await self.s3.upload_file(image, file_name, image.content_type)
             if uploaded is False:
                 raise UploadFileError('Cannot update car image', status_code=520)
 
-        return file_name
+        return file_name, image_variants
 
-    async def delete_car(self, car_id: int):
+    async def _upload_variants(self, image: UploadFile, file_name: str) -> dict[ImageSize, str]:
+        """Render resized WebP variants of an image on the process pool and upload them next to the original."""
+        data = await image.read()
+        await image.seek(0)
+        variants = await create_variants(data)
+
+        image_variants = variant_keys(file_name)
+        uploaded = await gather(
+            *(
+                self.s3.upload_file(UploadFile(BytesIO(variants[size]), filename=key), key, 'image/webp')
+                for size, key in image_variants.items()
+            )
+        )
+        if False in uploaded:
+            raise UploadFileError('Cannot upload car image variants', status_code=520)
+
+        return image_variants
+
+    async def replace_car_image(
+        self,
+        car_id: int,
+        chunks: AsyncIterator[bytes],
+        file_name: str,
+        content_type: str,
+        content_length: int | None = None,
+    ) -> CarSchema:
+        """Stream the request body straight into a multipart S3 upload instead of spooling it first."""
         try:
-            car = await self.repository.get_by_id(car_id)
-        except CarGettingError as err:
-            raise CarDeletingError(err.message, err.status_code)
+            self._check_image(content_type, content_length)
+            old_car = await self.repository.get_by_id(car_id)
 
-        deleted = await self.s3.delete_objects(car.image)
-        if deleted is False:
-            raise CarDeletingError('Cannot delete car image', status_code=520)
+            file_name = IMAGE_NAME.format(car_number=old_car.number, file_name=file_name)
+            await self.repository.claim_keys([file_name])
+            image = LimitedStream(chunks, get_settings().IMAGE_MAX_SIZE)
+            uploaded = await self.s3.upload_file(image, file_name, content_type)
+        except (CarGettingError, UploadFileError) as err:
+            raise CarUpdateError(err.message, err.status_code)
+        if uploaded is False:
+            raise CarUpdateError('Cannot update car image', status_code=520)
+
+        # Variants need the whole image in memory, which is what this path avoids, so GETs fall back to the original
+        updated_car = await self.repository.update_image(car_id, file_name)
+
+        updated_car.image = await self.s3.create_presigned_url(file_name)
+        return updated_car
 
+    @staticmethod
+    def _check_image(content_type: str | None, size: int | None):
+        settings = get_settings()
+
+        media_type = (content_type or '').split(';')[0].strip().lower()
+        if media_type not in settings.IMAGE_CONTENT_TYPES:
+            raise UploadFileError(
+                f'Image must be one of {settings.IMAGE_CONTENT_TYPES}, got {content_type!r}', status_code=415
+            )
+        if size is not None and size > settings.IMAGE_MAX_SIZE:
+            raise UploadFileError(f'Image is larger than {settings.IMAGE_MAX_SIZE} bytes', status_code=413)
+
+    async def delete_car(self, car_id: int):
+        # Images are deleted by the deletion worker once the removal commits, so S3 is not on this path
         await self.repository.remove(car_id)
 
-    async def get_cars_by_ids(self, car_ids: list[int]) -> list[CarSchema]:
+    async def get_cars_by_ids(
+        self, car_ids: list[int], size: ImageSize = ImageSize.original, if_none_match: str | None = None
+    ) -> tuple[list[CarSchema], str]:
         cars = await self.repository.get_by_ids(car_ids)
-        cars = await self._set_image_url(cars)
-        return cars
+
+        etag = cars_etag(cars, self._url_window(), size)
+        if etag_matches(if_none_match, etag):
+            raise NotModifiedError(etag)
+
+        cars = await self._set_image_url(cars, size)
+        return cars, etag
+
+    async def get_cars_batch(self, car_ids: list[int], size: ImageSize = ImageSize.original) -> CarBatchResultSchema:
+        car_ids = list(dict.fromkeys(car_ids))
+        max_size = get_settings().BATCH_MAX_SIZE
+        if len(car_ids) > max_size:
+            raise CarGettingError(f'Cannot get more than {max_size} cars at once, got {len(car_ids)}', status_code=422)
+
+        cars = await self.repository.get_by_ids(car_ids)
+        found_ids = {car.id for car in cars}
+        missing_ids = [car_id for car_id in car_ids if car_id not in found_ids]
+
+        cars = await self._set_image_url(cars, size)
+        return CarBatchResultSchema.model_construct(items=cars, missing_ids=missing_ids)
 
     async def update_cars_status(self, status_schema: StatusUpdateSchema) -> list[CarSchema]:
-        updated_cars = await self.repository.update_status(status_schema)
+        updated_cars = await self.repository.update_status(status_schema, get_settings().STATUS_UPDATE_CHUNK_SIZE)
         cars = await self._set_image_url(updated_cars)
         return cars
 
-    async def _set_image_url(self, cars: list[CarSchema]) -> list[CarSchema]:
-        tasks = [self.s3.create_presigned_url(car.image) for car in cars]
-        urls = await gather(*tasks)
+    async def update_cars_status_brief(self, status_schema: StatusUpdateSchema) -> StatusUpdateResultSchema:
+        updated = await self.repository.update_status_brief(status_schema, get_settings().STATUS_UPDATE_CHUNK_SIZE)
+        updated_ids = {car.id for car in updated}
+        skipped = [car_id for car_id in dict.fromkeys(status_schema.car_ids) if car_id not in updated_ids]
+        return StatusUpdateResultSchema(updated=updated, skipped=skipped)
+
+    async def _read_once(
+        self, key: Hashable, read: Callable[[CarRepository], Awaitable[T]], copy: Callable[[T], T] | None = None
+    ) -> T:
+        """Share one `read` between concurrent identical requests of the worker.
+
+        The shared read gets a session of its own, so it does not depend on the request that happened to start it.
+        Requests that must read from the primary after a write read on their own, an older shared read could miss it.
+        """
+        if reads_from_primary():
+            return await read(self.repository)
+
+        async def shared_read() -> T:
+            async with managed_session(read_only=True) as session:
+                return await read(CarRepository(session, get_car_cache(), session))
+
+        return await self.flights.do(key, shared_read, copy)
+
+    def _url_window(self) -> int:
+        return self.s3.url_cache.current_window()
+
+    @staticmethod
+    def _image_key(car: CarSchema, size: ImageSize) -> str:
+        return car.image_variants.get(size, car.image)
+
+    async def _set_image_url(self, cars: list[CarSchema], size: ImageSize = ImageSize.original) -> list[CarSchema]:
+        # Kept below AWS_S3_MAX_CONCURRENCY, so a large batch of uncached keys leaves S3 slots to other requests
+        semaphore = Semaphore(get_settings().AWS_S3_PRESIGN_CONCURRENCY)
+
+        async def presign(car: CarSchema) -> str | None:
+            async with semaphore:
+                return await self.s3.create_presigned_url(self._image_key(car, size))
+
+        urls = await gather(*(presign(car) for car in cars))
         for car, url in zip(cars, urls):
             car.image = url
         return cars
+
+
+class StationService:
+    def __init__(self, repository: StationRepository = Depends()):
+        self.repository = repository
+
+    async def get_summary(self, station_id: int) -> StationSummarySchema:
+        summaries = await self.repository.get_summaries(station_id)
+        return summaries[0] if summaries else empty_summary(station_id)
+
+    async def get_summaries(self) -> list[StationSummarySchema]:
+        return await self.repository.get_summaries()
+
+
+class QuoteService:
+    def __init__(
+        self,
+        snapshot: PricingSnapshot = Depends(get_pricing_snapshot),
+        rules: PricingRules = Depends(get_pricing_rules),
+    ):
+        self.snapshot = snapshot
+        self.rules = rules
+
+    async def quote(self, quote_schema: QuoteRequestSchema) -> dict[str, Any]:
+        """Price every car for every rental window.
+
+        The ids and prices are left as NumPy arrays, ORJSONResponse serializes them without building lists first.
+        """
+        columns = await self.snapshot.columns()
+        if quote_schema.car_ids is not None:
+            car_ids = np.array(list(dict.fromkeys(quote_schema.car_ids)), dtype=np.int64)
+            positions, found = columns.locate(car_ids)
+            missing_ids = car_ids[~found]
+        else:
+            positions = columns.matching(quote_schema.filters)
+            missing_ids = np.empty(0, dtype=np.int64)
+
+        windows = quote_schema.windows
+        max_prices = get_settings().QUOTE_MAX_PRICES
+        if len(positions) * len(windows) > max_prices:
+            raise QuoteError(
+                f'Cannot quote more than {max_prices} prices at once, got {len(positions)} cars '
+                f'for {len(windows)} windows',
+                status_code=422,
+            )
+
+        hours = rental_hours((window.end - window.start).total_seconds() for window in windows)
+        discounts = duration_discounts(hours, self.rules)
+        return {
+            'car_ids': columns.id[positions],
+            'windows': [
+                {'start': window.start, 'end': window.end, 'hours': int(window_hours), 'discount': float(discount)}
+                for window, window_hours, discount in zip(windows, hours, discounts)
+            ],
+            'prices': quote_prices(columns, positions, hours, self.rules),
+            'missing_ids': missing_ids,
+        }
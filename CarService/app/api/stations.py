@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Depends
+
+from app.api.schemas import StationSummarySchema
+from app.api.services import StationService
+
+router = APIRouter(tags=['Station'])
+
+
+@router.get('/stations/summary', response_model=list[StationSummarySchema])
+async def retrieve_station_summaries(station_service: StationService = Depends()):
+    return await station_service.get_summaries()
+
+
+@router.get('/stations/{station_id}/summary', response_model=StationSummarySchema)
+async def retrieve_station_summary(station_id: int, station_service: StationService = Depends()):
+    return await station_service.get_summary(station_id)
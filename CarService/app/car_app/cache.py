@@ -0,0 +1,80 @@
+from collections import OrderedDict
+from functools import lru_cache
+from time import monotonic
+from typing import Protocol
+
+from app.api.schemas import CarSchema
+from app.core.config import get_settings
+
+
+class CarCache(Protocol):
+    async def get_many(self, car_ids: list[int]) -> dict[int, CarSchema]: ...
+
+    async def set_many(self, cars: list[CarSchema]): ...
+
+    async def invalidate(self, car_ids: list[int]): ...
+
+    def stats(self) -> dict[str, float]: ...
+
+
+class InMemoryCarCache(CarCache):
+    """Per-worker LRU cache of cars whose entries expire `ttl` seconds after they were read from the database."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.served_age_total = 0.0
+        self.served_age_max = 0.0
+        self._cars: OrderedDict[int, tuple[float, CarSchema]] = OrderedDict()
+
+    async def get_many(self, car_ids: list[int]) -> dict[int, CarSchema]:
+        now = monotonic()
+
+        cars = {}
+        for car_id in car_ids:
+            stored_at, car = self._cars.get(car_id, (None, None))
+            if car is None or now - stored_at > self.ttl:
+                self._cars.pop(car_id, None)
+                self.misses += 1
+                continue
+
+            self._cars.move_to_end(car_id)
+            self.hits += 1
+            self.served_age_total += now - stored_at
+            self.served_age_max = max(self.served_age_max, now - stored_at)
+            # Callers replace `image` with a presigned URL, so they must never get the cached instance itself
+            cars[car_id] = car.model_copy()
+
+        return cars
+
+    async def set_many(self, cars: list[CarSchema]):
+        now = monotonic()
+        for car in cars:
+            self._cars[car.id] = (now, car.model_copy())
+            self._cars.move_to_end(car.id)
+
+        while len(self._cars) > self.max_size:
+            self._cars.popitem(last=False)
+
+    async def invalidate(self, car_ids: list[int]):
+        for car_id in car_ids:
+            self._cars.pop(car_id, None)
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'served_age_avg': self.served_age_total / self.hits if self.hits else 0.0,
+            'served_age_max': self.served_age_max,
+            'size': len(self._cars),
+        }
+
+
+@lru_cache
+def get_car_cache() -> CarCache:
+    return InMemoryCarCache(max_size=get_settings().CAR_CACHE_SIZE, ttl=get_settings().CAR_CACHE_TTL)
@@ -0,0 +1,284 @@
+"""Fan-out of the car changes announced by the `car_events` triggers to Server-Sent Events subscribers.
+
+Every worker holds a single LISTEN connection outside the pool and keeps the latest events in a ring buffer, so a
+reconnecting client resumes from its last event id without touching the database unless it fell further behind.
+
+Ids are taken when a change is written, not when it commits, so an event may commit after one with a higher id. The
+buffer keeps events in the order they were announced, which is the commit order, and a replay from the buffer sends
+what came after the last event of the client. The database only has the ids, so replays from it and the reload after
+the listener reconnects read `lookback` ids before the last event again, and the events already seen are skipped.
+"""
+
+import logging
+from asyncio import create_task, Event, FIRST_COMPLETED, Queue, QueueFull, Task, wait, wait_for
+from collections import deque
+from contextlib import suppress
+from functools import lru_cache
+from typing import AsyncIterator, Callable, NamedTuple, TypedDict
+
+import asyncpg
+import orjson
+from sqlalchemy import delete, func, select
+
+from app.core.config import get_settings
+from app.core.database import _async_engine, managed_session
+from app.core.enums import CarStatuse
+from app.models.events import CarEvent as CarEventModel
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'car_events'
+REPLAY_BATCH_SIZE = 1000
+RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 30
+PRUNE_INTERVAL = 60
+
+EVENT_COLUMNS = [
+    CarEventModel.id,
+    CarEventModel.car_id,
+    CarEventModel.type,
+    CarEventModel.station_id,
+    CarEventModel.status,
+    CarEventModel.previous_station_id,
+    CarEventModel.previous_status,
+    CarEventModel.version,
+]
+
+
+class CarEvent(TypedDict):
+    id: int
+    car_id: int
+    type: str
+    station_id: int
+    status: str
+    previous_station_id: int | None
+    previous_status: str | None
+    version: int
+
+
+class CarEventFilter(NamedTuple):
+    station_id: int | None = None
+    status: CarStatuse | None = None
+
+    def matches(self, event: CarEvent) -> bool:
+        # An update moving a car out of the station or status is sent to its subscribers as well
+        if self.station_id is not None and self.station_id not in (event['station_id'], event['previous_station_id']):
+            return False
+        return self.status is None or self.status in (event['status'], event['previous_status'])
+
+
+class Subscription:
+    def __init__(self, event_filter: CarEventFilter, queue_size: int):
+        self.filter = event_filter
+        self.queue: Queue[CarEvent | None] = Queue(queue_size)
+
+    def push(self, event: CarEvent) -> bool:
+        """Queue an event, a subscriber too slow to keep up is sent None instead and has to resume from its last id."""
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+            return False
+
+
+class CarEventHub:
+    def __init__(
+        self,
+        buffer_size: int = 10_000,
+        queue_size: int = 1000,
+        heartbeat: float = 15,
+        retention: int = 0,
+        lookback: int = 1000,
+    ):
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self.retention = retention
+        self.lookback = lookback
+
+        self._buffer: deque[CarEvent] = deque(maxlen=buffer_size)
+        self._buffered_ids: set[int] = set()
+        self._subscriptions: set[Subscription] = set()
+        self._listeners: list[Callable[[CarEvent], None]] = []
+        self._last_id: int | None = None
+        self._stopping: Event | None = None
+        self._task: Task | None = None
+
+    def start(self):
+        if self._task is None:
+            self._stopping = Event()
+            self._task = create_task(self._run())
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def stop(self):
+        if self._task is None:
+            return
+
+        self._stopping.set()
+        task, self._task = self._task, None
+        await task
+        for subscription in self._subscriptions:
+            subscription.push(None)
+
+    async def _run(self):
+        delay = RECONNECT_DELAY
+        while not self._stopping.is_set():
+            try:
+                await self._listen()
+                delay = RECONNECT_DELAY
+            except Exception as err:
+                logger.error(f'Car event listener failed, reconnecting in {delay}s, err={err}')
+                with suppress(TimeoutError):
+                    await wait_for(self._stopping.wait(), delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    async def _listen(self):
+        engine = _async_engine()
+        args, kwargs = engine.dialect.create_connect_args(engine.url)
+        connection = await asyncpg.connect(*args, **kwargs)
+        terminated = Event()
+        connection.add_termination_listener(lambda _: terminated.set())
+        try:
+            await connection.add_listener(CHANNEL, self._notified)
+            # Events committed while the listener was down were never announced to this worker
+            if self._last_id is not None:
+                async for events in self._load(self._last_id - self.lookback):
+                    self._publish(events)
+
+            while not self._stopping.is_set() and not terminated.is_set():
+                await self._prune()
+                await _wait_any(PRUNE_INTERVAL, self._stopping, terminated)
+        finally:
+            if not connection.is_closed():
+                await connection.close()
+
+        if terminated.is_set() and not self._stopping.is_set():
+            raise ConnectionError('LISTEN connection was closed')
+
+    def _notified(self, connection: asyncpg.Connection, pid: int, channel: str, payload: str):
+        self._publish(orjson.loads(payload))
+
+    def _publish(self, events: list[CarEvent]):
+        for event in events:
+            if event['id'] in self._buffered_ids:
+                continue
+            if len(self._buffer) == self._buffer.maxlen:
+                self._buffered_ids.discard(self._buffer[0]['id'])
+            self._buffer.append(event)
+            self._buffered_ids.add(event['id'])
+            self._last_id = event['id'] if self._last_id is None else max(self._last_id, event['id'])
+            for listener in self._listeners:
+                listener(event)
+
+            overflowed = [
+                subscription
+                for subscription in self._subscriptions
+                if subscription.filter.matches(event) and not subscription.push(event)
+            ]
+            self._subscriptions.difference_update(overflowed)
+
+    async def _prune(self):
+        if not self.retention:
+            return
+        try:
+            async with managed_session() as session:
+                await session.execute(
+                    delete(CarEventModel).where(
+                        CarEventModel.created_at < func.now() - func.make_interval(0, 0, 0, 0, 0, 0, self.retention)
+                    )
+                )
+        except Exception as err:
+            logger.warning(f'Cannot prune car events, err={err}')
+
+    def add_listener(self, listener: Callable[[CarEvent], None]):
+        """Call `listener` with every event received while the hub runs, it must not block the event loop."""
+        self._listeners.append(listener)
+
+    async def subscribe(
+        self, event_filter: CarEventFilter, last_event_id: int | None = None
+    ) -> AsyncIterator[CarEvent | None]:
+        """Yield the events matching `event_filter` after `last_event_id`, then the new ones as they come.
+
+        None is yielded when nothing happened for `heartbeat` seconds. The iterator ends when the subscriber fell
+        behind by more than its queue or the hub stops. A subscriber resuming from an event no longer buffered may get
+        events of up to `lookback` ids before it again.
+        """
+        subscription = Subscription(event_filter, self.queue_size)
+        # Subscribing before the replay may deliver an event twice but never loses one in between
+        self._subscriptions.add(subscription)
+        try:
+            replayed = set()
+            if last_event_id is not None:
+                async for events in self._replay(last_event_id):
+                    for event in events:
+                        if event_filter.matches(event):
+                            replayed.add(event['id'])
+                            yield event
+
+            while True:
+                try:
+                    event = await wait_for(subscription.queue.get(), self.heartbeat)
+                except TimeoutError:
+                    yield None
+                    continue
+
+                if event is None:
+                    return
+                if event['id'] not in replayed:
+                    yield event
+        finally:
+            self._subscriptions.discard(subscription)
+
+    async def _replay(self, last_event_id: int) -> AsyncIterator[list[CarEvent]]:
+        if last_event_id in self._buffered_ids:
+            buffered = list(self._buffer)
+            position = next(index for index in reversed(range(len(buffered))) if buffered[index]['id'] == last_event_id)
+            yield buffered[position + 1 :]
+            return
+
+        async for events in self._load(last_event_id - self.lookback):
+            yield [event for event in events if event['id'] != last_event_id]
+
+    @staticmethod
+    async def _load(last_event_id: int) -> AsyncIterator[list[CarEvent]]:
+        while True:
+            query = (
+                select(*EVENT_COLUMNS)
+                .where(CarEventModel.id > last_event_id)
+                .order_by(CarEventModel.id)
+                .limit(REPLAY_BATCH_SIZE)
+            )
+            # A session per batch, so a slow subscriber does not hold a pooled connection while it reads
+            async with managed_session() as session:
+                events = [CarEvent(**row._mapping) for row in await session.execute(query)]
+            if not events:
+                return
+
+            yield events
+            last_event_id = events[-1]['id']
+
+
+async def _wait_any(timeout: float, *events: Event):
+    waiters = [create_task(event.wait()) for event in events]
+    try:
+        await wait(waiters, timeout=timeout, return_when=FIRST_COMPLETED)
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+
+
+@lru_cache
+def get_car_event_hub() -> CarEventHub:
+    settings = get_settings()
+    return CarEventHub(
+        buffer_size=settings.CAR_EVENTS_BUFFER_SIZE,
+        queue_size=settings.CAR_EVENTS_QUEUE_SIZE,
+        heartbeat=settings.CAR_EVENTS_HEARTBEAT,
+        retention=settings.CAR_EVENTS_RETENTION,
+        lookback=settings.CAR_EVENTS_REPLAY_LOOKBACK,
+    )
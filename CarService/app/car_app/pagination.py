@@ -0,0 +1,97 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from sqlalchemy import and_, ColumnElement, or_, Row, Select, tuple_
+from sqlalchemy.orm import InstrumentedAttribute
+
+from app.core.enums import CarSorting
+from app.core.exceptions import CarGettingError
+from app.models.cars import Car
+
+# Ids are int4 columns, asyncpg rejects anything outside its range
+MAX_ID = 2**31 - 1
+
+SORT_COLUMNS: dict[CarSorting, tuple[InstrumentedAttribute, bool]] = {
+    CarSorting.id_asc: (Car.id, False),
+    CarSorting.id_desc: (Car.id, True),
+    CarSorting.created_at_asc: (Car.created_at, False),
+    CarSorting.created_at_desc: (Car.created_at, True),
+}
+
+
+def encode_cursor(sorting: CarSorting, car: Row) -> str:
+    column, _ = SORT_COLUMNS[sorting]
+    value = getattr(car, column.key)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+
+    payload = json.dumps([sorting.value, value, car.id], separators=(',', ':'))
+    return urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(sorting: CarSorting, cursor: str) -> tuple:
+    column, _ = SORT_COLUMNS[sorting]
+    try:
+        cursor_sorting, value, car_id = json.loads(urlsafe_b64decode(cursor.encode()))
+        car_id = cursor_id(car_id)
+        value = datetime.fromisoformat(value) if column is Car.created_at else cursor_id(value)
+    except (ValueError, TypeError) as err:
+        raise CarGettingError(f'Invalid cursor {cursor!r}, err={err}', 400)
+
+    if cursor_sorting != sorting.value:
+        raise CarGettingError(f'Cursor was issued for sorting {cursor_sorting!r}, not {sorting.value!r}', 400)
+
+    return value, car_id
+
+
+def paginate(query: Select, sorting: CarSorting, limit: int, cursor: str | None = None) -> Select:
+    column, descending = SORT_COLUMNS[sorting]
+    keys = (column,) if column is Car.id else (column, Car.id)
+
+    if cursor is not None:
+        value, car_id = decode_cursor(sorting, cursor)
+        bound = (value,) if column is Car.id else (value, car_id)
+        if descending:
+            query = query.where(tuple_(*keys) < tuple_(*bound))
+        else:
+            query = query.where(tuple_(*keys) > tuple_(*bound))
+
+    order_by = [key.desc() if descending else key.asc() for key in keys]
+    return query.order_by(*order_by).limit(limit + 1)
+
+
+def encode_search_cursor(q: str, car: Row) -> str:
+    payload = json.dumps([q, car.rank, car.id], separators=(',', ':'))
+    return urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_search_cursor(q: str, cursor: str) -> tuple[float, int]:
+    try:
+        cursor_q, rank, car_id = json.loads(urlsafe_b64decode(cursor.encode()))
+        rank, car_id = float(rank), cursor_id(car_id)
+    except (ValueError, TypeError) as err:
+        raise CarGettingError(f'Invalid cursor {cursor!r}, err={err}', 400)
+
+    if cursor_q != q:
+        raise CarGettingError(f'Cursor was issued for search {cursor_q!r}, not {q!r}', 400)
+
+    return rank, car_id
+
+
+def paginate_search(query: Select, rank: ColumnElement[float], q: str, limit: int, cursor: str | None = None) -> Select:
+    """Order search results by descending `rank` and then by id, the keyset has to mix both directions."""
+    if cursor is not None:
+        last_rank, car_id = decode_search_cursor(q, cursor)
+        query = query.where(or_(rank < last_rank, and_(rank == last_rank, Car.id > car_id)))
+
+    return query.order_by(rank.desc(), Car.id.asc()).limit(limit + 1)
+
+
+def cursor_id(value) -> int:
+    """A car id taken from a decoded cursor, which is built by the client and may hold anything JSON allows."""
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise TypeError(f'Car id must be an integer, got {value!r}')
+    if not -MAX_ID - 1 <= value <= MAX_ID:
+        raise ValueError(f'Car id {value} is out of range')
+    return value
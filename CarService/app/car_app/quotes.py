@@ -0,0 +1,230 @@
+"""Rental quotes priced in one vectorized pass over a columnar snapshot of the pricing fields of all cars.
+
+Every worker keeps the snapshot in memory as NumPy arrays, about 20 bytes a car. Changes announced by the car event
+hub are patched in on the next quote, and the whole snapshot is reloaded once it is older than `max_age`, which also
+bounds how stale it gets in a process that does not run the hub.
+"""
+
+import logging
+from datetime import date
+from functools import lru_cache
+from time import monotonic
+from typing import Iterable, NamedTuple, Sequence
+
+import numpy as np
+from sqlalchemy import any_, bindparam, Integer, Row, select
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from app.api.schemas import CarFilterSchema
+from app.car_app.events import CarEvent, CarEventHub, get_car_event_hub
+from app.core.config import get_settings
+from app.core.database import managed_session
+from app.core.enums import Brand, CarStatuse, Category, FuelType
+from app.core.singleflight import get_single_flight, SingleFlight
+from app.models.cars import Car
+
+logger = logging.getLogger(__name__)
+
+PRICING_QUERY = select(
+    Car.id, Car.cost_per_hour, Car.category, Car.year, Car.status, Car.station_id, Car.brand, Car.fuel_type
+)
+PRICING_BY_IDS = PRICING_QUERY.where(Car.id == any_(bindparam('car_ids', type_=ARRAY(Integer))))
+
+# Enum fields are kept as the position of their value in the enum
+CODED_FIELDS = {'category': Category, 'status': CarStatuse, 'brand': Brand, 'fuel_type': FuelType}
+CODES = {enum: {value: code for code, value in enumerate(enum)} for enum in CODED_FIELDS.values()}
+
+
+class PricingColumns(NamedTuple):
+    """Pricing fields of cars sorted by id, an array per field."""
+
+    id: np.ndarray
+    cost_per_hour: np.ndarray
+    category: np.ndarray
+    year: np.ndarray
+    status: np.ndarray
+    station_id: np.ndarray
+    brand: np.ndarray
+    fuel_type: np.ndarray
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Row]) -> 'PricingColumns':
+        fields = dict(zip(cls._fields, zip(*rows))) if rows else dict.fromkeys(cls._fields, ())
+        columns = cls(
+            id=np.array(fields['id'], dtype=np.int32),
+            cost_per_hour=np.array(fields['cost_per_hour'], dtype=np.float64),
+            category=_codes(fields['category'], Category),
+            year=np.array(fields['year'], dtype=np.int16),
+            status=_codes(fields['status'], CarStatuse),
+            station_id=np.array(fields['station_id'], dtype=np.int32),
+            brand=_codes(fields['brand'], Brand),
+            fuel_type=_codes(fields['fuel_type'], FuelType),
+        )
+        return columns.take(np.argsort(columns.id, kind='stable'))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self)
+
+    def take(self, index: np.ndarray) -> 'PricingColumns':
+        return PricingColumns(*(column[index] for column in self))
+
+    def patch(self, car_ids: np.ndarray, changed: 'PricingColumns') -> 'PricingColumns':
+        """Replace the cars of `car_ids` with `changed`, a car of `car_ids` missing from `changed` was deleted."""
+        kept = self.take(~np.isin(self.id, car_ids))
+        merged = PricingColumns(*(np.concatenate(pair) for pair in zip(kept, changed)))
+        return merged.take(np.argsort(merged.id, kind='stable'))
+
+    def locate(self, car_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Positions of the cars of `car_ids` that exist, and a mask of the ids found."""
+        positions = np.searchsorted(self.id, car_ids)
+        found = positions < len(self.id)
+        found[found] = self.id[positions[found]] == car_ids[found]
+        return positions[found], found
+
+    def matching(self, filters: CarFilterSchema) -> np.ndarray:
+        """Positions of the cars matching `filters`, the same cars `filter_conditions` selects."""
+        mask = np.ones(len(self.id), dtype=bool)
+        for field, enum in CODED_FIELDS.items():
+            value = getattr(filters, field)
+            if value is not None:
+                mask &= getattr(self, field) == CODES[enum][value]
+
+        if filters.station_id is not None:
+            mask &= self.station_id == filters.station_id
+        if filters.year is not None:
+            mask &= self.year == filters.year
+        if filters.min_cost_per_hour is not None:
+            mask &= self.cost_per_hour >= filters.min_cost_per_hour
+        if filters.max_cost_per_hour is not None:
+            mask &= self.cost_per_hour <= filters.max_cost_per_hour
+
+        return np.flatnonzero(mask)
+
+
+class PricingSnapshot:
+    def __init__(self, hub: CarEventHub, flights: SingleFlight, max_age: float = 300):
+        self.flights = flights
+        self.max_age = max_age
+        self.loads = 0
+        self.patches = 0
+
+        self._columns: PricingColumns | None = None
+        self._loaded_at = 0.0
+        self._changed: set[int] = set()
+        self._tracking = False
+        hub.add_listener(self._car_changed)
+
+    def _car_changed(self, event: CarEvent):
+        # Tracked from the first load on, a change committed after the load read the cars is patched in afterwards
+        if self._tracking:
+            self._changed.add(event['car_id'])
+
+    def _stale(self) -> bool:
+        return self._columns is None or monotonic() - self._loaded_at > self.max_age
+
+    async def columns(self) -> PricingColumns:
+        if self._stale() or self._changed:
+            await self.flights.do('pricing_snapshot', self._refresh)
+        return self._columns
+
+    async def _refresh(self):
+        self._tracking = True
+        reload = self._stale()
+        changed, self._changed = self._changed, set()
+        try:
+            # Changes are announced once they commit on the primary, a replica may not have them yet
+            async with managed_session() as session:
+                if reload:
+                    rows = (await session.execute(PRICING_QUERY)).all()
+                else:
+                    rows = (await session.execute(PRICING_BY_IDS, {'car_ids': list(changed)})).all()
+        except BaseException:
+            # Events that came in meanwhile are in `_changed` already
+            self._changed |= changed
+            raise
+
+        if reload:
+            self._columns = PricingColumns.from_rows(rows)
+            self._loaded_at = monotonic()
+            self.loads += 1
+            logger.info(f'Loaded pricing snapshot of {len(rows)} cars, {self._columns.nbytes} bytes')
+        else:
+            self._columns = self._columns.patch(np.array(list(changed), dtype=np.int64), PricingColumns.from_rows(rows))
+            self.patches += 1
+
+    def stats(self) -> dict[str, float]:
+        return {
+            'cars': len(self._columns.id) if self._columns is not None else 0,
+            'bytes': self._columns.nbytes if self._columns is not None else 0,
+            'age_seconds': monotonic() - self._loaded_at if self._columns is not None else 0.0,
+            'pending_changes': len(self._changed),
+            'loads': self.loads,
+            'patches': self.patches,
+        }
+
+
+class PricingRules(NamedTuple):
+    """Pricing settings as arrays, tiers are looked up by their lower bound."""
+
+    duration_hours: np.ndarray
+    duration_discounts: np.ndarray
+    category_multipliers: np.ndarray
+    ages: np.ndarray
+    age_multipliers: np.ndarray
+
+    @classmethod
+    def from_tiers(
+        cls,
+        duration_discounts: dict[int, float],
+        category_multipliers: dict[Category, float],
+        age_multipliers: dict[int, float],
+    ) -> 'PricingRules':
+        # Tiers without a bound of 0 start with a plain price below their first bound
+        durations = sorted(({0: 0.0} | duration_discounts).items())
+        ages = sorted(({0: 1.0} | age_multipliers).items())
+        return cls(
+            duration_hours=np.array([hours for hours, _ in durations], dtype=np.float64),
+            duration_discounts=np.array([discount for _, discount in durations], dtype=np.float64),
+            category_multipliers=np.array([category_multipliers.get(category, 1.0) for category in Category]),
+            ages=np.array([age for age, _ in ages], dtype=np.int16),
+            age_multipliers=np.array([multiplier for _, multiplier in ages], dtype=np.float64),
+        )
+
+
+def rental_hours(seconds: Iterable[float]) -> np.ndarray:
+    """Billed hours of rentals lasting `seconds`, every started hour counts."""
+    return np.ceil(np.fromiter(seconds, dtype=np.float64) / 3600)
+
+
+def duration_discounts(hours: np.ndarray, rules: PricingRules) -> np.ndarray:
+    return rules.duration_discounts[np.searchsorted(rules.duration_hours, hours, side='right') - 1]
+
+
+def quote_prices(columns: PricingColumns, positions: np.ndarray, hours: np.ndarray, rules: PricingRules) -> np.ndarray:
+    """Prices of the cars at `positions` for rentals of `hours`, a row per car and a column per rental."""
+    ages = np.maximum(date.today().year - columns.year[positions], 0)
+    hourly = (
+        columns.cost_per_hour[positions]
+        * rules.category_multipliers[columns.category[positions]]
+        * rules.age_multipliers[np.searchsorted(rules.ages, ages, side='right') - 1]
+    )
+    return np.round(np.outer(hourly, hours * (1 - duration_discounts(hours, rules))), 2)
+
+
+def _codes(values: Sequence[str], enum: type) -> np.ndarray:
+    codes = CODES[enum]
+    return np.fromiter((codes[value] for value in values), dtype=np.uint8, count=len(values))
+
+
+@lru_cache
+def get_pricing_snapshot() -> PricingSnapshot:
+    return PricingSnapshot(get_car_event_hub(), get_single_flight(), get_settings().QUOTE_SNAPSHOT_MAX_AGE)
+
+
+@lru_cache
+def get_pricing_rules() -> PricingRules:
+    settings = get_settings()
+    return PricingRules.from_tiers(
+        settings.QUOTE_DURATION_DISCOUNTS, settings.QUOTE_CATEGORY_MULTIPLIERS, settings.QUOTE_AGE_MULTIPLIERS
+    )
@@ -1,73 +1,422 @@
+from datetime import datetime
+from typing import AsyncIterator
+
 from fastapi import Depends
-from sqlalchemy import delete, insert, select, update
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import (
+    any_,
+    bindparam,
+    case,
+    column,
+    ColumnElement,
+    delete,
+    Float,
+    func,
+    insert,
+    Integer,
+    literal,
+    or_,
+    Row,
+    select,
+    String,
+    table,
+    text,
+    update,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from sqlalchemy.exc import DBAPIError, IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.api.schemas import CarCreatingSchema, CarSchema, CarUpdatingSchema, StatusUpdateSchema
-from app.core.database import get_session
-from app.core.exceptions import CarCreationError, CarGettingError, CarUpdateError
+from app.api.schemas import (
+    CarCreatingSchema,
+    CarFilterSchema,
+    CarPageSchema,
+    CarSchema,
+    CarStatusSchema,
+    CarUpdatingSchema,
+    StatusUpdateSchema,
+)
+from app.car_app.cache import CarCache, get_car_cache
+from app.car_app.pagination import encode_cursor, encode_search_cursor, paginate, paginate_search
+from app.core.database import get_read_session, get_session, has_extension, on_commit, on_primary
+from app.core.enums import CarSorting, ImageSize
+from app.core.exceptions import (
+    CarCreationError,
+    CarDeletingError,
+    CarGettingError,
+    CarUpdateError,
+    PartialUpdateError,
+)
+from app.core.replicas import reads_from_primary
 from app.models.cars import Car
+from app.models.deletions import ObjectDeletion
+
+IMPORT_COLUMNS = [
+    'number',
+    'image',
+    'brand',
+    'description',
+    'transmission',
+    'fuel_type',
+    'color',
+    'category',
+    'engine_capacity',
+    'year',
+    'status',
+    'station_id',
+    'cost_per_hour',
+]
+IMPORT_TABLE = table('cars_import', *(column(name) for name in IMPORT_COLUMNS))
+
+CAR_FIELDS = list(CarSchema.model_fields)
+CAR_COLUMNS = [getattr(Car, name) for name in CAR_FIELDS]
+
+# A single array parameter keeps the statement text the same for any number of ids, so it is prepared once
+CARS_BY_IDS = select(*CAR_COLUMNS).where(Car.id == any_(bindparam('car_ids', type_=ARRAY(Integer))))
 
 
 class CarRepository:
-    def __init__(self, session: AsyncSession = Depends(get_session)):
+    """Car queries, read-only ones go through `read_session`, which may be bound to a replica."""
+
+    def __init__(
+        self,
+        session: AsyncSession = Depends(get_session),
+        cache: CarCache = Depends(get_car_cache),
+        read_session: AsyncSession = Depends(get_read_session),
+    ):
         self._session = session
+        self._cache = cache
+        self._read_session = read_session
 
     async def get_by_id(self, car_id: int) -> CarSchema:
-        query = select(Car).where(Car.id == car_id)
-
-        car = await self._session.scalar(query)
-        if car is None:
+        cars = await self.get_by_ids([car_id])
+        if not cars:
             raise CarGettingError(f'Car with id {car_id} does not exist', 404)
+        return cars[0]
+
+    async def get_page(
+        self, filters: CarFilterSchema, sorting: CarSorting, limit: int, cursor: str | None = None
+    ) -> CarPageSchema:
+        query = paginate(
+            select(*CAR_COLUMNS, Car.created_at).where(*filter_conditions(filters)), sorting, limit, cursor
+        )
+
+        rows = (await self._read_session.execute(query)).all()
+        next_cursor = encode_cursor(sorting, rows[limit - 1]) if len(rows) > limit else None
 
-        return CarSchema.model_validate(car)
+        return CarPageSchema.model_construct(items=[car_from_row(row) for row in rows[:limit]], next_cursor=next_cursor)
 
-    async def get_all(self) -> list[CarSchema]:
-        query = select(Car)
-        cars = await self._session.scalars(query)
-        return [CarSchema.model_validate(car) for car in cars]
+    async def search(self, q: str, filters: CarFilterSchema, limit: int, cursor: str | None = None) -> CarPageSchema:
+        """Cars whose number contains `q` or whose description has words similar to it, the most relevant first.
 
-    async def create(self, car_schema: CarCreatingSchema, file_name: str) -> CarSchema:
-        full_schema = car_schema.model_dump() | {'image': file_name}
-        query = insert(Car).values(full_schema).returning(Car)
+        Without the pg_trgm extension the description has to contain `q` as well, and cars are ordered by id.
+        """
+        trigram = await has_extension(self._read_session, 'pg_trgm')
+        rank = search_rank(q, trigram)
+        query = paginate_search(
+            select(*CAR_COLUMNS, rank.label('rank')).where(search_condition(q, trigram), *filter_conditions(filters)),
+            rank,
+            q,
+            limit,
+            cursor,
+        )
+
+        rows = (await self._read_session.execute(query)).all()
+        next_cursor = encode_search_cursor(q, rows[limit - 1]) if len(rows) > limit else None
+
+        return CarPageSchema.model_construct(items=[car_from_row(row) for row in rows[:limit]], next_cursor=next_cursor)
+
+    async def get_state(self, filters: CarFilterSchema) -> tuple[int, datetime | None]:
+        """Count and last modification time of the filtered cars, enough to tell whether any of them changed."""
+        query = select(func.count(), func.max(Car.created_at)).where(*filter_conditions(filters))
+        count, last_modified = (await self._read_session.execute(query)).one()
+        return count, last_modified
+
+    async def stream(self, filters: CarFilterSchema, batch_size: int) -> AsyncIterator[list[CarSchema]]:
+        query = (
+            select(*CAR_COLUMNS)
+            .where(*filter_conditions(filters))
+            .order_by(Car.id)
+            .execution_options(yield_per=batch_size)
+        )
+
+        rows = await self._read_session.stream(query)
+        async for partition in rows.partitions():
+            yield [car_from_row(row) for row in partition]
+
+    async def create(
+        self, car_schema: CarCreatingSchema, file_name: str, image_variants: dict[ImageSize, str] | None = None
+    ) -> CarSchema:
+        full_schema = car_schema.model_dump() | {'image': file_name, 'image_variants': image_variants or {}}
+        query = insert(Car).values(full_schema).returning(*CAR_COLUMNS)
 
         try:
-            car = await self._session.scalar(query)
+            row = (await self._session.execute(query)).one()
         except IntegrityError as err:
             raise CarCreationError(f'Cannot create car with {car_schema.model_dump()}, err={err}', status_code=409)
 
-        return CarSchema.model_validate(car)
+        await self._unqueue_deletions(image_keys(row.image, row.image_variants))
+        self._invalidate([row.id])
+        return car_from_row(row)
+
+    async def bulk_create(self, cars: list[tuple[CarCreatingSchema, str | None]]) -> dict[str, int]:
+        """COPY cars into a staging table and move them into `cars`, skipping rows that hit a unique constraint.
 
-    async def update(self, car_id: int, car_schema: CarUpdatingSchema, file_name: str) -> CarSchema:
-        full_schema = car_schema.model_dump() | {'image': file_name}
-        query = update(Car).filter(Car.id == car_id).values(full_schema).returning(Car)
+        Returns ids of the inserted cars by their numbers.
+        """
+        if not cars:
+            return {}
+
+        columns = ', '.join(IMPORT_COLUMNS)
+        await self._session.execute(
+            text(
+                f'CREATE TEMP TABLE IF NOT EXISTS cars_import ON COMMIT DROP AS SELECT {columns} FROM cars WITH NO DATA'
+            )
+        )
+        await self._session.execute(text('TRUNCATE cars_import'))
+
+        records = [
+            tuple((car_schema.model_dump() | {'image': file_name})[name] for name in IMPORT_COLUMNS)
+            for car_schema, file_name in cars
+        ]
+        connection = await self._session.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            'cars_import', records=records, columns=IMPORT_COLUMNS
+        )
+
+        query = (
+            pg_insert(Car)
+            .from_select(IMPORT_COLUMNS, select(IMPORT_TABLE))
+            .on_conflict_do_nothing()
+            .returning(Car.number, Car.id, Car.image)
+        )
+        rows = (await self._session.execute(query)).all()
+        created = {row.number: row.id for row in rows}
+
+        await self._unqueue_deletions([row.image for row in rows if row.image])
+        self._invalidate(list(created.values()))
+        return created
+
+    async def find_taken(self, numbers: list[str], keys: list[str]) -> tuple[set[str], set[str]]:
+        """Numbers and image keys out of the given ones that existing cars already use."""
+        query = select(Car.number, Car.image).where(
+            or_(
+                Car.number == any_(bindparam('numbers', type_=ARRAY(String))),
+                Car.image == any_(bindparam('keys', type_=ARRAY(String))),
+            )
+        )
+        rows = (await self._session.execute(query, {'numbers': numbers, 'keys': keys})).all()
+        return {row.number for row in rows}, {row.image for row in rows if row.image is not None}
+
+    async def update(
+        self,
+        car_id: int,
+        car_schema: CarUpdatingSchema,
+        file_name: str,
+        image_variants: dict[ImageSize, str] | None = None,
+    ) -> CarSchema:
+        """Update a car, its image variants are kept as they are unless new ones are given."""
+        old_keys = await self._lock_image_keys(car_id)
+        if old_keys is None:
+            raise CarUpdateError(f'Car with id {car_id} does not exist', 404)
+
+        full_schema = car_schema.model_dump() | {'image': file_name, 'version': Car.version + 1}
+        if image_variants is not None:
+            full_schema['image_variants'] = image_variants
+        query = update(Car).filter(Car.id == car_id).values(full_schema).returning(*CAR_COLUMNS)
 
         try:
-            car = await self._session.scalar(query)
+            row = (await self._session.execute(query)).first()
         except IntegrityError as err:
             raise CarUpdateError(f'Cannot update car with {car_schema.model_dump()}, err={err}', status_code=409)
 
-        return CarSchema.model_validate(car)
+        car = car_from_row(row)
+        await self._release_images(old_keys, car)
+        self._invalidate([car_id])
+        return car
+
+    async def update_image(
+        self, car_id: int, file_name: str, image_variants: dict[ImageSize, str] | None = None
+    ) -> CarSchema:
+        old_keys = await self._lock_image_keys(car_id)
+        if old_keys is None:
+            raise CarUpdateError(f'Car with id {car_id} does not exist', 404)
+
+        query = (
+            update(Car)
+            .where(Car.id == car_id)
+            .values(image=file_name, image_variants=image_variants or {}, version=Car.version + 1)
+            .returning(*CAR_COLUMNS)
+        )
+
+        try:
+            row = (await self._session.execute(query)).first()
+        except IntegrityError as err:
+            raise CarUpdateError(f'Cannot update image of car {car_id} to {file_name}, err={err}', status_code=409)
+
+        car = car_from_row(row)
+        await self._release_images(old_keys, car)
+        self._invalidate([car_id])
+        return car
 
     async def remove(self, car_id: int):
-        query = delete(Car).where(Car.id == car_id)
-        await self._session.execute(query)
+        """Delete a car and queue deletion of its images in the same transaction."""
+        query = delete(Car).where(Car.id == car_id).returning(Car.image, Car.image_variants)
+
+        row = (await self._session.execute(query)).first()
+        if row is None:
+            raise CarDeletingError(f'Car with id {car_id} does not exist', 404)
+
+        await self.enqueue_deletions(image_keys(row.image, row.image_variants))
+        self._invalidate([car_id])
+
+    def _invalidate(self, car_ids: list[int]):
+        # Invalidated before the commit, the entry could be filled again with the old row by a concurrent read
+        on_commit(self._session, lambda: self._cache.invalidate(car_ids))
+
+    async def claim_keys(self, keys: list[str]):
+        """Unqueue deletions of keys about to be uploaded, committed before the upload starts.
+
+        The deletion worker keeps the rows it claimed locked until their objects are deleted, so this waits for a
+        deletion in progress and the upload lands after it. Unqueued keys cannot be claimed by the worker afterwards.
+        """
+        if keys:
+            await self._unqueue_deletions(keys)
+            await self._session.commit()
+
+    async def enqueue_deletions(self, keys: list[str]):
+        """Queue S3 keys for the deletion worker, they are only deleted if the current transaction commits."""
+        if keys:
+            await self._session.execute(insert(ObjectDeletion), [{'key': key} for key in keys])
+
+    async def _lock_image_keys(self, car_id: int) -> list[str] | None:
+        query = select(Car.image, Car.image_variants).where(Car.id == car_id).with_for_update()
+        row = (await self._session.execute(query)).first()
+        return None if row is None else image_keys(row.image, row.image_variants)
+
+    async def _release_images(self, old_keys: list[str], car: CarSchema):
+        keys = image_keys(car.image, car.image_variants)
+        if not set(keys) <= set(old_keys):
+            await self._unqueue_deletions(keys)
+        # An image uploaded under the same stem overwrote the old objects in place, so only keys the car does not use
+        # anymore are released, never the ones just uploaded
+        await self.enqueue_deletions(released_image_keys(old_keys, keys))
+
+    async def _unqueue_deletions(self, keys: list[str]):
+        """Drop queued deletions of keys a car takes in the current transaction.
+
+        A reused key may still be queued from an earlier change, and deleting it would drop the new upload.
+        """
+        if keys:
+            await self._session.execute(delete(ObjectDeletion).where(ObjectDeletion.key.in_(keys)))
 
     async def get_by_ids(self, car_ids: list[int]) -> list[CarSchema]:
-        query = select(Car).where(Car.id.in_(car_ids))
+        """Cars in the order of their first id in `car_ids`, ids of missing cars are left out."""
+        car_ids = list(dict.fromkeys(car_ids))
+        # The cache of another worker may still hold a car the client has just changed
+        fresh = reads_from_primary()
+        cars = {} if fresh else await self._cache.get_many(car_ids)
 
-        cars = await self._session.scalars(query)
-        if cars is None:
-            raise CarGettingError(f'Cars with ids {car_ids} do not exist', 404)
+        missing_ids = [car_id for car_id in car_ids if car_id not in cars]
+        if missing_ids:
+            rows = await self._read_session.execute(CARS_BY_IDS, {'car_ids': missing_ids})
+            loaded = [car_from_row(row) for row in rows]
+            # A replica may lag behind an invalidation, and the stale row would stay cached until the next write
+            if not fresh and on_primary(self._read_session):
+                await self._cache.set_many(loaded)
+            cars |= {car.id: car for car in loaded}
 
-        return [CarSchema.model_validate(car) for car in cars]
+        return [cars[car_id] for car_id in car_ids if car_id in cars]
 
-    async def update_status(self, status_schema: StatusUpdateSchema) -> list[CarSchema]:
-        query = update(Car).where(Car.id.in_(status_schema.car_ids)).values(status=status_schema.status).returning(Car)
+    async def update_status(self, status_schema: StatusUpdateSchema, chunk_size: int) -> list[CarSchema]:
+        updated = await self._update_status(status_schema, chunk_size, *CAR_COLUMNS)
+        return [car_from_row(row) for row in updated]
 
-        try:
-            cars = await self._session.scalars(query)
-        except IntegrityError as err:
-            raise CarUpdateError(f'Cannot update car with {status_schema.model_dump()}, err={err}', status_code=409)
+    async def update_status_brief(self, status_schema: StatusUpdateSchema, chunk_size: int) -> list[CarStatusSchema]:
+        updated = await self._update_status(status_schema, chunk_size, Car.id, Car.status, Car.version)
+        return [CarStatusSchema.model_construct(**row._mapping) for row in updated]
+
+    async def _update_status(self, status_schema: StatusUpdateSchema, chunk_size: int, *returning) -> list[Row]:
+        """Update cars in chunks committed one by one, so row locks are held for a single chunk only.
+
+        Cars whose version does not match `status_schema.versions` are left untouched and not returned. A chunk that
+        fails is rolled back, the chunks committed before it stay, and their ids are given with the error.
+        """
+        car_ids = list(dict.fromkeys(status_schema.car_ids))
+
+        updated = []
+        for start in range(0, len(car_ids), chunk_size):
+            chunk = car_ids[start : start + chunk_size]
+            query = update(Car).where(Car.id.in_(chunk))
+
+            versions = {car_id: status_schema.versions[car_id] for car_id in chunk if car_id in status_schema.versions}
+            if versions:
+                query = query.where(Car.version == case(versions, value=Car.id, else_=Car.version))
+
+            query = query.values(status=status_schema.status, version=Car.version + 1).returning(*returning)
+            try:
+                result = await self._session.execute(query)
+                rows = result.all()
+                await self._session.commit()
+            except DBAPIError as err:
+                await self._session.rollback()
+                updated_ids = [row.id for row in updated]
+                raise PartialUpdateError(
+                    f'Cannot update cars {chunk[0]}..{chunk[-1]} with status {status_schema.status}, '
+                    f'{len(updated_ids)} cars were updated before, err={err}',
+                    status_code=409 if isinstance(err, IntegrityError) else 503,
+                    updated_ids=updated_ids,
+                )
+            updated.extend(rows)
+            await self._cache.invalidate(chunk)
+
+        return updated
+
+
+def image_keys(image: str | None, image_variants: dict[str, str]) -> list[str]:
+    return [key for key in (image, *image_variants.values()) if key]
+
+
+def released_image_keys(old_keys: list[str], keys: list[str]) -> list[str]:
+    kept = set(keys)
+    return [key for key in old_keys if key not in kept]
+
+
+def car_from_row(row: Row) -> CarSchema:
+    """Build a car from a row starting with CAR_COLUMNS without validation, the database constraints already hold."""
+    return CarSchema.model_construct(**dict(zip(CAR_FIELDS, row)))
+
+
+def search_condition(q: str, trigram: bool = True) -> ColumnElement[bool]:
+    # Both operators are served by the trigram GIN indexes, `%>` holds when a part of the description is similar
+    # enough to `q` by pg_trgm.word_similarity_threshold, so a misspelled word still matches
+    pattern = '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    if not trigram:
+        return or_(Car.number.ilike(pattern, escape='\\'), Car.description.ilike(pattern, escape='\\'))
+    return or_(Car.number.ilike(pattern, escape='\\'), Car.description.op('%>', is_comparison=True)(q))
+
+
+def search_rank(q: str, trigram: bool = True) -> ColumnElement[float]:
+    if not trigram:
+        return literal(0.0, Float)
+    # greatest() skips the NULL similarity of a car without a description
+    return func.greatest(
+        func.word_similarity(literal(q), Car.number),
+        func.word_similarity(literal(q), Car.description),
+        type_=Float,
+    )
+
+
+def filter_conditions(filters: CarFilterSchema) -> list[ColumnElement[bool]]:
+    conditions = []
+    for field in ('status', 'station_id', 'brand', 'category', 'fuel_type', 'year'):
+        value = getattr(filters, field)
+        if value is not None:
+            conditions.append(getattr(Car, field) == value)
+
+    if filters.min_cost_per_hour is not None:
+        conditions.append(Car.cost_per_hour >= filters.min_cost_per_hour)
+    if filters.max_cost_per_hour is not None:
+        conditions.append(Car.cost_per_hour <= filters.max_cost_per_hour)
 
-        return [CarSchema.model_validate(car) for car in cars]
+    return conditions
@@ -0,0 +1,82 @@
+from typing import NamedTuple
+
+from fastapi import Depends
+from sqlalchemy import and_, delete, func, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.schemas import StationSummarySchema
+from app.core.database import get_read_session
+from app.core.enums import CarStatuse, Category
+from app.models.cars import Car
+from app.models.stations import StationCarCount
+
+COUNT_CARS = select(Car.station_id, Car.status, Car.category, func.count().label('count')).group_by(
+    Car.station_id, Car.status, Car.category
+)
+
+
+class CountDrift(NamedTuple):
+    station_id: int
+    status: CarStatuse
+    category: Category
+    stored: int
+    actual: int
+
+
+class StationRepository:
+    """Per-station summaries read from `station_car_counts`, so a summary costs a row per non-empty group."""
+
+    def __init__(self, read_session: AsyncSession = Depends(get_read_session)):
+        self._read_session = read_session
+
+    async def get_summaries(self, station_id: int | None = None) -> list[StationSummarySchema]:
+        query = (
+            select(StationCarCount.station_id, StationCarCount.status, StationCarCount.category, StationCarCount.count)
+            .where(StationCarCount.count != 0)
+            .order_by(StationCarCount.station_id)
+        )
+        if station_id is not None:
+            query = query.where(StationCarCount.station_id == station_id)
+
+        summaries: dict[int, StationSummarySchema] = {}
+        for row in await self._read_session.execute(query):
+            summary = summaries.get(row.station_id)
+            if summary is None:
+                summary = summaries[row.station_id] = empty_summary(row.station_id)
+
+            summary.total += row.count
+            summary.statuses[row.status] += row.count
+            summary.categories.setdefault(row.category, dict.fromkeys(CarStatuse, 0))[row.status] += row.count
+
+        return list(summaries.values())
+
+
+def empty_summary(station_id: int) -> StationSummarySchema:
+    return StationSummarySchema(station_id=station_id, total=0, statuses=dict.fromkeys(CarStatuse, 0), categories={})
+
+
+async def reconcile_counts(session: AsyncSession) -> list[CountDrift]:
+    """Rebuild `station_car_counts` from `cars` and return the groups whose stored count was wrong.
+
+    Writes to `cars` wait for the rebuild, so no trigger can update a counter between the count and the rewrite.
+    """
+    await session.execute(text('LOCK TABLE cars IN SHARE MODE'))
+
+    actual = COUNT_CARS.cte('actual_counts')
+    stored = StationCarCount.__table__
+    key_columns = ['station_id', 'status', 'category']
+    drift_query = (
+        select(
+            *(func.coalesce(actual.c[name], stored.c[name]).label(name) for name in key_columns),
+            func.coalesce(stored.c.count, 0).label('stored'),
+            func.coalesce(actual.c.count, 0).label('actual'),
+        )
+        .select_from(actual.join(stored, and_(*(actual.c[name] == stored.c[name] for name in key_columns)), full=True))
+        .where(func.coalesce(stored.c.count, 0) != func.coalesce(actual.c.count, 0))
+        .order_by(*key_columns)
+    )
+    drifts = [CountDrift(*row) for row in await session.execute(drift_query)]
+
+    await session.execute(delete(StationCarCount))
+    await session.execute(insert(StationCarCount).from_select([*key_columns, 'count'], COUNT_CARS))
+    return drifts
@@ -0,0 +1,66 @@
+"""Maintenance commands that must not run inside the serving workers.
+
+python -m app.cli migrate [revision]
+python -m app.cli reconcile-counts
+"""
+
+import argparse
+import asyncio
+import sys
+
+from alembic.command import upgrade
+from alembic.config import Config
+from pydantic import PostgresDsn
+
+from app.car_app.stations import reconcile_counts
+from app.core.config import get_settings
+from app.core.database import dispose_engines, managed_session
+
+
+def get_alembic_config(database_url: PostgresDsn, script_location: str = 'migrations') -> Config:
+    alembic_config = Config()
+    alembic_config.set_main_option('script_location', script_location)
+    alembic_config.set_main_option(
+        'sqlalchemy.url',
+        database_url.unicode_string().replace('postgresql+psycopg', 'postgresql'),
+    )
+    return alembic_config
+
+
+def migrate(revision: str):
+    upgrade(get_alembic_config(get_settings().DATABASE_URL), revision)
+
+
+async def reconcile():
+    try:
+        async with managed_session() as session:
+            drifts = await reconcile_counts(session)
+    finally:
+        await dispose_engines()
+
+    for drift in drifts:
+        sys.stdout.write(
+            f'station_id={drift.station_id} status={drift.status} category={drift.category}: '
+            f'stored {drift.stored}, actual {drift.actual}\n'
+        )
+    sys.stdout.write(f'Rebuilt station car counts, {len(drifts)} groups were wrong\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    migrate_parser = commands.add_parser('migrate', help='upgrade the database to the given revision')
+    migrate_parser.add_argument('revision', nargs='?', default='head')
+
+    commands.add_parser('reconcile-counts', help='rebuild the per-station car counts from the cars table')
+
+    args = parser.parse_args()
+    if args.command == 'migrate':
+        migrate(args.revision)
+    elif args.command == 'reconcile-counts':
+        asyncio.run(reconcile())
+
+
+if __name__ == '__main__':
+    main()
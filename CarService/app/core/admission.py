@@ -0,0 +1,121 @@
+"""Admission control: per-route caps on requests in flight, with a bounded queue in front of each cap.
+
+A request over the cap waits in the queue for up to `queue_timeout` seconds. When the queue is full or the wait runs
+out, it is rejected with 503 and Retry-After before it checks out a database connection or starts any S3 call, so a
+spike on one route cannot drain the pool the others need.
+"""
+
+from asyncio import Semaphore, timeout
+from contextlib import asynccontextmanager
+from time import perf_counter
+from typing import AsyncIterator, Sequence
+
+from fastapi.responses import ORJSONResponse
+from starlette.routing import BaseRoute, Match
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.core.metrics import add_phase_time, ADMISSION_REJECTIONS
+
+
+class AdmissionRejected(Exception):
+    pass
+
+
+class ConcurrencyLimit:
+    def __init__(self, concurrency: int, queue_size: int, queue_timeout: float):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = Semaphore(concurrency)
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        if self._semaphore.locked():
+            if self.waiting >= self.queue_size:
+                raise AdmissionRejected('queue_full')
+
+            self.waiting += 1
+            started = perf_counter()
+            try:
+                # wait_for of Python 3.11 can drop a permit acquired just as it times out, which would lower the cap
+                # for good. The timeout cancels acquire() itself instead, and the semaphore hands such a permit on.
+                async with timeout(self.queue_timeout):
+                    await self._semaphore.acquire()
+            except TimeoutError:
+                raise AdmissionRejected('queue_timeout')
+            finally:
+                self.waiting -= 1
+                add_phase_time('admission', perf_counter() - started)
+        else:
+            await self._semaphore.acquire()
+
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+
+class AdmissionMiddleware:
+    """Applies a ConcurrencyLimit per route, `limits` maps `METHOD /path/template` to (concurrency, queue size).
+
+    Routes missing from `limits` get `default`. A concurrency of 0 leaves a route unlimited, which suits long-lived
+    streams that hold no pooled connection while they wait.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        routes: Sequence[BaseRoute],
+        limits: dict[str, tuple[int, int]],
+        default: tuple[int, int] = (0, 0),
+        queue_timeout: float = 5,
+        retry_after: int = 1,
+    ):
+        self.app = app
+        self.routes = routes
+        self.retry_after = retry_after
+
+        self._limits: dict[str, ConcurrencyLimit | None] = {}
+        for route in routes:
+            for method in getattr(route, 'methods', None) or ():
+                name = f'{method} {route.path}'
+                concurrency, queue_size = limits.get(name, default)
+                self._limits[name] = ConcurrencyLimit(concurrency, queue_size, queue_timeout) if concurrency else None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        route = self._match(scope)
+        name = f'{scope["method"]} {route.path}' if route is not None else None
+        limit = self._limits.get(name)
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        # The router would set it as well, MetricsMiddleware needs it for the requests rejected here
+        scope['route'] = route
+        try:
+            async with limit.admit():
+                await self.app(scope, receive, send)
+        except AdmissionRejected as err:
+            ADMISSION_REJECTIONS.inc(route=route.path, reason=str(err))
+            response = ORJSONResponse(
+                {'detail': 'Server is busy, retry later'},
+                status_code=503,
+                headers={'Retry-After': str(self.retry_after)},
+            )
+            await response(scope, receive, send)
+
+    def _match(self, scope: Scope) -> BaseRoute | None:
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match is Match.FULL:
+                return route
+        return None
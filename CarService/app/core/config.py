@@ -1,16 +1,93 @@
 from functools import lru_cache
 
-from pydantic import PostgresDsn
+from pydantic import Field, PostgresDsn
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+from app.core.enums import Category, PrePing, ReplicaRouting
+
 
 class Settings(BaseSettings):
     PROJECT_NAME: str = 'CarService'
 
     DATABASE_URL: PostgresDsn
+    DATABASE_CHECK_MIGRATIONS: bool = True
+    DATABASE_WARMUP_CONNECTIONS: int = 2
+    DATABASE_POOL_SIZE: int = 10
+    DATABASE_MAX_OVERFLOW: int = 10
+    DATABASE_POOL_TIMEOUT: float = 30
+    DATABASE_POOL_RECYCLE: int = 30 * 60
+    DATABASE_PRE_PING: PrePing = PrePing.idle
+    DATABASE_PRE_PING_IDLE_SECONDS: float = 30
+    DATABASE_STATEMENT_CACHE_SIZE: int = 100
+    DATABASE_REPLICA_URLS: list[PostgresDsn] = []
+    DATABASE_REPLICA_ROUTING: ReplicaRouting = ReplicaRouting.round_robin
+    DATABASE_READ_YOUR_WRITES_SECONDS: float = 5
+
+    METRICS_SLOW_REQUEST_SECONDS: float = 0
+
+    ADMISSION_LIMITS: dict[str, tuple[int, int]] = {
+        'GET /cars/events': (0, 0),
+        'GET /cars/export': (4, 8),
+        'POST /cars/import': (2, 4),
+    }
+    ADMISSION_DEFAULT_CONCURRENCY: int = 16
+    ADMISSION_DEFAULT_QUEUE_SIZE: int = 64
+    ADMISSION_QUEUE_TIMEOUT: float = 5
+    ADMISSION_RETRY_AFTER: int = 1
+
+    CAR_CACHE_SIZE: int = 10_000
+    CAR_CACHE_TTL: float = 30
+
+    CAR_EVENTS_BUFFER_SIZE: int = 10_000
+    CAR_EVENTS_QUEUE_SIZE: int = 1000
+    CAR_EVENTS_HEARTBEAT: float = 15
+    CAR_EVENTS_RETENTION: int = 24 * 60 * 60
+    CAR_EVENTS_REPLAY_LOOKBACK: int = 1000
+
+    EXPORT_BATCH_SIZE: int = 1000
+    EXPORT_PRESIGN_CONCURRENCY: int = 100
+
+    IMPORT_BATCH_SIZE: int = 1000
+    IMPORT_UPLOAD_CONCURRENCY: int = 16
+
+    STATUS_UPDATE_CHUNK_SIZE: int = Field(500, gt=0)
+
+    BATCH_MAX_SIZE: int = 1000
+    SEARCH_MIN_LENGTH: int = 3
+
+    QUOTE_MAX_PRICES: int = 200_000
+    QUOTE_SNAPSHOT_MAX_AGE: float = 300
+    # Discount by the rental hours it starts at, multipliers by category and by the car age in years it starts at
+    QUOTE_DURATION_DISCOUNTS: dict[int, float] = {24: 0.1, 72: 0.15, 168: 0.25}
+    QUOTE_CATEGORY_MULTIPLIERS: dict[Category, float] = {
+        Category.economy: 0.9,
+        Category.suv: 1.2,
+        Category.luxury: 1.5,
+        Category.sports: 1.4,
+        Category.convertible: 1.3,
+        Category.minivan: 1.1,
+        Category.pickup_truck: 1.1,
+    }
+    QUOTE_AGE_MULTIPLIERS: dict[int, float] = {0: 1.1, 2: 1.0, 8: 0.85}
+
+    IMAGE_MAX_SIZE: int = 20 * 1024 * 1024
+    IMAGE_CONTENT_TYPES: list[str] = ['image/jpeg', 'image/png', 'image/webp']
+    IMAGE_PROCESS_WORKERS: int = 2
+    IMAGE_DELETION_BATCH_SIZE: int = 1000
+    IMAGE_DELETION_INTERVAL: float = 1
+    IMAGE_DELETION_MAX_DELAY: int = 60 * 60
 
     AWS_S3_CARS_BUCKET_NAME: str
     AWS_S3_ENDPOINT_URL: str | None = None
+    AWS_S3_MAX_POOL_CONNECTIONS: int = 50
+    AWS_S3_TCP_KEEPALIVE: bool = True
+    AWS_S3_PRESIGNED_URL_CACHE_SIZE: int = 10_000
+    AWS_S3_PRESIGNED_URL_WINDOW: int = 15 * 60
+    AWS_S3_PRESIGN_CONCURRENCY: int = 16
+    AWS_S3_UPLOAD_PART_SIZE: int = 8 * 1024 * 1024
+    AWS_S3_UPLOAD_CONCURRENCY: int = 4
+    AWS_S3_MAX_CONCURRENCY: int = 50
+    AWS_S3_WARMUP_TIMEOUT: float = 5
 
     model_config = SettingsConfigDict(
         case_sensitive=True,
@@ -1,23 +1,122 @@
-from contextlib import asynccontextmanager
+from asyncio import gather
+from contextlib import asynccontextmanager, AsyncExitStack
 from functools import lru_cache
-from typing import AsyncIterable
+from time import monotonic
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable
 
-from alembic.config import Config
-from pydantic import PostgresDsn
+import orjson
+from fastapi import Depends
+from sqlalchemy import event, text
+from sqlalchemy.exc import DisconnectionError
 from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session
 
 from app.core.config import get_settings
+from app.core.enums import PrePing
+from app.core.metrics import CheckoutTimedPool, instrument_engine
+from app.core.replicas import mark_write, reads_from_primary, ReplicaRouter
 
 Base = declarative_base()
 
+PENDING_CALLBACKS = 'after_commit_pending'
+COMMITTED_CALLBACKS = 'after_commit_committed'
+
+EXTENSION_QUERY = text('SELECT EXISTS (SELECT FROM pg_extension WHERE extname = :name)')
+
+_installed_extensions: dict[str, bool] = {}
+
 
 @lru_cache
 def _async_engine() -> AsyncEngine:
-    return create_async_engine(
-        get_settings().DATABASE_URL.unicode_string(),
-        pool_pre_ping=True,
+    engine = _create_engine(get_settings().DATABASE_URL.unicode_string())
+
+    @event.listens_for(engine.sync_engine, 'after_cursor_execute')
+    def remember_write(connection, cursor, statement, parameters, context, executemany):
+        if context.isinsert or context.isupdate or context.isdelete:
+            mark_write()
+
+    return engine
+
+
+@lru_cache
+def _replica_router() -> ReplicaRouter | None:
+    settings = get_settings()
+    if not settings.DATABASE_REPLICA_URLS:
+        return None
+
+    engines = [_create_engine(url.unicode_string()) for url in settings.DATABASE_REPLICA_URLS]
+    return ReplicaRouter(engines, settings.DATABASE_REPLICA_ROUTING)
+
+
+def _create_engine(url: str) -> AsyncEngine:
+    settings = get_settings()
+    engine = create_async_engine(
+        url,
+        poolclass=CheckoutTimedPool,
+        pool_size=settings.DATABASE_POOL_SIZE,
+        max_overflow=settings.DATABASE_MAX_OVERFLOW,
+        pool_timeout=settings.DATABASE_POOL_TIMEOUT,
+        pool_recycle=settings.DATABASE_POOL_RECYCLE,
+        pool_pre_ping=settings.DATABASE_PRE_PING is PrePing.always,
+        # Cache of prepared statements per connection, 0 disables it behind a transaction-mode PgBouncer
+        connect_args={'prepared_statement_cache_size': settings.DATABASE_STATEMENT_CACHE_SIZE},
+        json_serializer=_dump_json,
+        json_deserializer=orjson.loads,
     )
+    instrument_engine(engine)
+    if settings.DATABASE_PRE_PING is PrePing.idle:
+        _ping_idle_connections(engine, settings.DATABASE_PRE_PING_IDLE_SECONDS)
+    return engine
+
+
+def _ping_idle_connections(engine: AsyncEngine, idle_seconds: float):
+    """Ping only connections that sat in the pool for `idle_seconds`, instead of paying a round-trip per checkout."""
+    pool = engine.sync_engine.pool
+
+    @event.listens_for(pool, 'checkin')
+    def remember_checkin(dbapi_connection, connection_record):
+        connection_record.info['checked_in_at'] = monotonic()
+
+    @event.listens_for(pool, 'checkout')
+    def ping_idle(dbapi_connection, connection_record, connection_proxy):
+        checked_in_at = connection_record.info.pop('checked_in_at', None)
+        if checked_in_at is None or monotonic() - checked_in_at < idle_seconds:
+            return
+
+        try:
+            engine.dialect.do_ping(dbapi_connection)
+        except Exception as err:
+            # The pool discards the connection and retries the checkout with a fresh one
+            raise DisconnectionError(f'Connection idle for {monotonic() - checked_in_at:.0f}s is gone, err={err}')
+
+
+async def dispose_engines():
+    await _async_engine().dispose()
+    if _replica_router() is not None:
+        await gather(*(engine.dispose() for engine in _replica_router().engines))
+
+
+def pool_statuses() -> dict[str, dict[str, int]]:
+    statuses = {'db_pool': _pool_status(_async_engine())}
+    if _replica_router() is not None:
+        for number, engine in enumerate(_replica_router().engines):
+            statuses[f'db_replica_{number}_pool'] = _pool_status(engine)
+    return statuses
+
+
+def _pool_status(engine: AsyncEngine) -> dict[str, int]:
+    pool = engine.sync_engine.pool
+    return {
+        'size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': pool.overflow(),
+    }
+
+
+def _dump_json(value: Any) -> str:
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
 
 
 @lru_cache
@@ -30,30 +129,80 @@ def _async_session_factory() -> async_sessionmaker:
 
 
 @asynccontextmanager
-async def _get_managed_session():
+async def managed_session(read_only: bool = False) -> AsyncIterator[AsyncSession]:
+    """Session on the primary, or with `read_only` on a replica unless the request has to read from the primary."""
     factory: async_sessionmaker = _async_session_factory()
-    session: AsyncSession = factory()
+    session: AsyncSession = factory(bind=_read_engine()) if read_only else factory()
     try:
         yield session
     except Exception as e:
-        await session.rollback()
+        if session.in_transaction():
+            await session.rollback()
         raise e
     else:
-        await session.commit()
+        # A session checks a connection out on its first statement, so untouched sessions never reach the pool
+        if session.in_transaction():
+            await session.commit()
     finally:
         await session.close()
 
+    for callback in session.info.pop(COMMITTED_CALLBACKS, []):
+        await callback()
+
+
+def on_commit(session: AsyncSession, callback: Callable[[], Awaitable[Any]]):
+    """Await `callback` once the current transaction of `session` commits, it is dropped if the transaction rolls back.
+
+    Callbacks run when the session of `managed_session` is closed, also for transactions committed earlier.
+    """
+    session.info.setdefault(PENDING_CALLBACKS, []).append(callback)
+
+
+@event.listens_for(Session, 'after_commit')
+def _commit_callbacks(session: Session):
+    session.info.setdefault(COMMITTED_CALLBACKS, []).extend(session.info.pop(PENDING_CALLBACKS, []))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_callbacks(session: Session):
+    session.info.pop(PENDING_CALLBACKS, None)
+
 
 async def get_session() -> AsyncIterable[AsyncSession]:
-    async with _get_managed_session() as session:
+    async with managed_session() as session:
         yield session
 
 
-def get_alembic_config(database_url: PostgresDsn, script_location: str = 'migrations') -> Config:
-    alembic_config = Config()
-    alembic_config.set_main_option('script_location', script_location)
-    alembic_config.set_main_option(
-        'sqlalchemy.url',
-        database_url.unicode_string().replace('postgresql+psycopg', 'postgresql'),
-    )
-    return alembic_config
+async def get_read_session(session: AsyncSession = Depends(get_session)) -> AsyncIterable[AsyncSession]:
+    if _replica_router() is None or reads_from_primary():
+        yield session
+        return
+
+    async with managed_session(read_only=True) as read_session:
+        yield read_session
+
+
+async def has_extension(session: AsyncSession, name: str) -> bool:
+    """Whether the extension `name` is installed, looked up once per process."""
+    if name not in _installed_extensions:
+        _installed_extensions[name] = await session.scalar(EXTENSION_QUERY, {'name': name})
+    return _installed_extensions[name]
+
+
+def on_primary(session: AsyncSession) -> bool:
+    """Whether `session` reads from the primary, so what it reads is never behind a committed write."""
+    return session.bind is _async_engine()
+
+
+def _read_engine() -> AsyncEngine:
+    router = _replica_router()
+    if router is None or reads_from_primary():
+        return _async_engine()
+    return router.choose()
+
+
+async def warm_up_pool(connections: int):
+    """Open `connections` pooled connections up front so the first requests do not pay for the handshakes."""
+    async with AsyncExitStack() as stack:
+        opened = await gather(*(stack.enter_async_context(_async_engine().connect()) for _ in range(connections)))
+        await gather(*(connection.execute(text('SELECT 1')) for connection in opened))
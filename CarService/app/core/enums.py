@@ -60,3 +60,38 @@ class Category(StrEnum):
     convertible = auto()
     minivan = auto()
     pickup_truck = auto()
+
+
+class CarSorting(StrEnum):
+    id_asc = auto()
+    id_desc = auto()
+    created_at_asc = auto()
+    created_at_desc = auto()
+
+
+class DataFormat(StrEnum):
+    ndjson = auto()
+    csv = auto()
+
+
+class ImageSize(StrEnum):
+    original = auto()
+    thumbnail = auto()
+    medium = auto()
+
+
+class ReplicaRouting(StrEnum):
+    round_robin = auto()
+    least_connections = auto()
+
+
+class PrePing(StrEnum):
+    always = auto()
+    idle = auto()
+    never = auto()
+
+
+class CarEventType(StrEnum):
+    created = auto()
+    updated = auto()
+    deleted = auto()
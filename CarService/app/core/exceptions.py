@@ -17,9 +17,25 @@ class CarUpdateError(BaseServiceError):
     pass
 
 
+class PartialUpdateError(CarUpdateError):
+    def __init__(self, message: str, status_code: int, updated_ids: list[int]):
+        super().__init__(message, status_code)
+        self.updated_ids = updated_ids
+
+
 class CarDeletingError(BaseServiceError):
     pass
 
 
+class QuoteError(BaseServiceError):
+    pass
+
+
 class UploadFileError(BaseServiceError):
     pass
+
+
+class NotModifiedError(BaseServiceError):
+    def __init__(self, etag: str):
+        super().__init__('Not modified', status_code=304)
+        self.etag = etag
@@ -0,0 +1,221 @@
+"""In-process metrics exported in the Prometheus text format, and a per-request breakdown of where time went.
+
+Metrics are kept per worker, so every worker has to be scraped on its own.
+"""
+
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from math import inf
+from time import perf_counter
+from typing import Any, Iterable, Iterator
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Seconds spent per phase of the current request, shared by the tasks and greenlets the request spawns
+_request_phases: ContextVar[dict[str, float] | None] = ContextVar('request_phases', default=None)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(str(labels[label]) for label in self.labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        for key, value in self._values.items():
+            yield f'{self.name}{_format_labels(zip(self.labels, key))} {value}'
+
+
+class Histogram:
+    def __init__(
+        self, name: str, documentation: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = (*buckets, inf)
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels[label]) for label in self.labels)
+        counts, total = self._values.setdefault(key, ([0] * len(self.buckets), [0.0]))
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def render(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for key, (counts, total) in self._values.items():
+            labels = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = '+Inf' if bound is inf else repr(float(bound))
+                yield f'{self.name}_bucket{_format_labels([*labels, ("le", le)])} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(labels)} {total[0]}'
+            yield f'{self.name}_count{_format_labels(labels)} {cumulative}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[Counter | Histogram] = []
+
+    def counter(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Histogram:
+        metric = Histogram(name, documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, stats: dict[str, dict[str, float]] | None = None) -> str:
+        """Render all metrics, every value of `stats` is exported as a `<prefix>_<key>` gauge."""
+        lines = [line for metric in self._metrics for line in metric.render()]
+        for prefix, values in (stats or {}).items():
+            for key, value in values.items():
+                lines += [f'# TYPE {prefix}_{key} gauge', f'{prefix}_{key} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Time to handle a request', ('method', 'route', 'status')
+)
+DB_STATEMENT_SECONDS = REGISTRY.histogram(
+    'db_statement_duration_seconds', 'Time to execute a SQL statement', ('operation',)
+)
+DB_STATEMENT_ERRORS = REGISTRY.counter('db_statement_errors_total', 'SQL statements that failed', ('operation',))
+DB_POOL_WAIT_SECONDS = REGISTRY.histogram('db_pool_checkout_wait_seconds', 'Time to check a connection out of the pool')
+S3_OPERATION_SECONDS = REGISTRY.histogram('s3_operation_duration_seconds', 'Time of an S3 operation', ('operation',))
+ADMISSION_REJECTIONS = REGISTRY.counter(
+    'http_requests_rejected_total', 'Requests rejected by admission control', ('route', 'reason')
+)
+S3_OPERATION_ERRORS = REGISTRY.counter('s3_operation_errors_total', 'S3 operations that failed', ('operation',))
+
+
+def add_phase_time(phase: str, seconds: float):
+    phases = _request_phases.get()
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def timed_phase(phase: str) -> Iterator[None]:
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        add_phase_time(phase, perf_counter() - started)
+
+
+class MetricsMiddleware:
+    """Observes the latency of every request by route template, and logs requests slower than `slow_request_seconds`
+    with the time they spent per phase. Phases are summed, so concurrent calls may add up to more than the request.
+    Event streams stay open by design and are never logged as slow.
+    """
+
+    def __init__(self, app: ASGIApp, slow_request_seconds: float = 0):
+        self.app = app
+        self.slow_request_seconds = slow_request_seconds
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        streaming = False
+
+        async def send_with_status(message: Message):
+            nonlocal status, streaming
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                streaming = any(
+                    name == b'content-type' and value.startswith(b'text/event-stream')
+                    for name, value in message.get('headers', [])
+                )
+            await send(message)
+
+        phases = {}
+        token = _request_phases.set(phases)
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            seconds = perf_counter() - started
+            _request_phases.reset(token)
+
+            # The router stores the matched route in the scope, its template keeps the label cardinality low
+            route = scope.get('route')
+            path = getattr(route, 'path', 'unmatched')
+            REQUEST_SECONDS.observe(seconds, method=scope['method'], route=path, status=status)
+
+            if self.slow_request_seconds and seconds >= self.slow_request_seconds and not streaming:
+                breakdown = ' '.join(f'{phase}={value:.3f}s' for phase, value in sorted(phases.items()))
+                logger.warning(f'Slow request {scope["method"]} {path} {status} took {seconds:.3f}s: {breakdown}')
+
+
+class CheckoutTimedPool(AsyncAdaptedQueuePool):
+    """Pool timing how long a checkout waits for a connection, which no pool or engine event covers."""
+
+    def _do_get(self):
+        started = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            seconds = perf_counter() - started
+            DB_POOL_WAIT_SECONDS.observe(seconds)
+            add_phase_time('db_pool', seconds)
+
+
+def instrument_engine(engine: AsyncEngine):
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def start_statement(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault('statement_started', []).append(perf_counter())
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def finish_statement(connection, cursor, statement, parameters, context, executemany):
+        seconds = perf_counter() - connection.info['statement_started'].pop()
+        DB_STATEMENT_SECONDS.observe(seconds, operation=_operation(statement))
+        add_phase_time('db', seconds)
+
+    @event.listens_for(sync_engine, 'handle_error')
+    def fail_statement(exception_context):
+        started = exception_context.connection.info.get('statement_started') if exception_context.connection else None
+        if started:
+            add_phase_time('db', perf_counter() - started.pop())
+        DB_STATEMENT_ERRORS.inc(operation=_operation(exception_context.statement or ''))
+
+
+def _operation(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'UNKNOWN'
+
+
+def _format_labels(labels: Iterable[tuple[str, Any]]) -> str:
+    formatted = [f'{name}="{_escape(value)}"' for name, value in labels]
+    return '{' + ','.join(formatted) + '}' if formatted else ''
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
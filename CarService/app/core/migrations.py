@@ -0,0 +1,46 @@
+import re
+from pathlib import Path
+
+from sqlalchemy import text
+
+from app.core.database import _async_engine
+
+VERSIONS_PATH = Path('migrations/versions')
+
+REVISION_PATTERN = re.compile(r"^revision(?::[^=]*)?=\s*'(\w+)'", re.MULTILINE)
+DOWN_REVISION_PATTERN = re.compile(r'^down_revision(?::[^=]*)?=(.*)$', re.MULTILINE)
+
+
+def script_heads(versions_path: Path = VERSIONS_PATH) -> set[str]:
+    """Head revisions of the migration scripts, read without importing Alembic and the scripts themselves."""
+    revisions, parents = set(), set()
+    for script in versions_path.glob('*.py'):
+        source = script.read_text()
+        revision = REVISION_PATTERN.search(source)
+        if revision is None:
+            continue
+
+        revisions.add(revision.group(1))
+        down_revision = DOWN_REVISION_PATTERN.search(source)
+        if down_revision is not None:
+            parents.update(re.findall(r"'(\w+)'", down_revision.group(1)))
+
+    return revisions - parents
+
+
+async def check_database_revision(versions_path: Path = VERSIONS_PATH):
+    """Fail unless the primary database is migrated to the heads of the migration scripts."""
+    async with _async_engine().connect() as connection:
+        # A database that was never migrated has no alembic_version table at all
+        if await connection.scalar(text("SELECT to_regclass('alembic_version')")) is None:
+            applied = set()
+        else:
+            applied = set(await connection.scalars(text('SELECT version_num FROM alembic_version')))
+
+    heads = script_heads(versions_path)
+    if not applied:
+        raise RuntimeError(f'Database has no migrations applied, run `python -m app.cli migrate` to {sorted(heads)}')
+    if applied != heads:
+        raise RuntimeError(
+            f'Database is at revision {sorted(applied)} instead of {sorted(heads)}, run `python -m app.cli migrate`'
+        )
@@ -0,0 +1,100 @@
+"""Routing of read-only sessions to replicas, and stickiness to the primary for clients that have just written."""
+
+from contextvars import ContextVar
+from http.cookies import CookieError, SimpleCookie
+from time import time
+from typing import Collection
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.enums import ReplicaRouting
+
+PRIMARY_COOKIE = 'read_primary_until'
+SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+
+class ReadState:
+    """Per-request flags, the object is shared with the tasks the request spawns, so they see each other's writes."""
+
+    def __init__(self, primary: bool = False):
+        self.primary = primary
+        self.wrote = False
+
+
+_read_state: ContextVar[ReadState | None] = ContextVar('read_state', default=None)
+
+
+def reads_from_primary() -> bool:
+    state = _read_state.get()
+    return state is not None and state.primary
+
+
+def mark_write():
+    state = _read_state.get()
+    if state is not None:
+        state.wrote = True
+        state.primary = True
+
+
+class ReplicaRouter:
+    def __init__(self, engines: list[AsyncEngine], routing: ReplicaRouting = ReplicaRouting.round_robin):
+        self.engines = engines
+        self.routing = routing
+        self._next = 0
+
+    def choose(self) -> AsyncEngine:
+        if self.routing is ReplicaRouting.least_connections:
+            return min(self.engines, key=lambda engine: engine.sync_engine.pool.checkedout())
+
+        engine = self.engines[self._next % len(self.engines)]
+        self._next += 1
+        return engine
+
+
+class ReadYourWritesMiddleware:
+    """Sends reads of a client to the primary for `window` seconds after the client wrote anything.
+
+    Requests with unsafe methods read from the primary too, so a write never acts on data a replica has not caught
+    up with yet, except for `read_only_paths`, which only read despite their method. The window is kept in a cookie,
+    so it holds across workers without shared state. Without replicas it still keeps such reads out of shared reads
+    and the car cache, which may predate the write.
+    """
+
+    def __init__(self, app: ASGIApp, window: float, read_only_paths: Collection[str] = ()):
+        self.app = app
+        self.window = window
+        self.read_only_paths = frozenset(read_only_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        unsafe = scope['method'] not in SAFE_METHODS and scope['path'] not in self.read_only_paths
+        state = ReadState(primary=unsafe or self._primary_until(scope) > time())
+
+        async def send_with_cookie(message: Message):
+            if message['type'] == 'http.response.start' and state.wrote and self.window > 0:
+                cookie = f'{PRIMARY_COOKIE}={time() + self.window:.3f}; Max-Age={int(self.window) or 1}; Path=/'
+                MutableHeaders(scope=message).append('set-cookie', f'{cookie}; HttpOnly; SameSite=Lax')
+            await send(message)
+
+        token = _read_state.set(state)
+        try:
+            await self.app(scope, receive, send_with_cookie)
+        finally:
+            _read_state.reset(token)
+
+    @staticmethod
+    def _primary_until(scope: Scope) -> float:
+        for name, value in scope['headers']:
+            if name != b'cookie':
+                continue
+            try:
+                morsel = SimpleCookie(value.decode('latin-1')).get(PRIMARY_COOKIE)
+                return float(morsel.value) if morsel is not None else 0
+            except (CookieError, ValueError):
+                return 0
+        return 0
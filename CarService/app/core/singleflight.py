@@ -0,0 +1,65 @@
+from asyncio import create_task, shield, Task
+from functools import lru_cache
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar('T')
+
+
+class Flight:
+    def __init__(self, task: Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Runs a call once for all concurrent callers with the same key, they all await the call already in flight.
+
+    Nothing is kept once the call finishes, a caller only joins a call that was already running when it arrived. The
+    call runs in a task of its own: a caller that is cancelled leaves it running for the others, and the call is
+    cancelled only when its last caller goes away.
+    """
+
+    def __init__(self):
+        self.started = 0
+        self.joined = 0
+        self._flights: dict[Hashable, Flight] = {}
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[T]], copy: Callable[[T], T] | None = None) -> T:
+        """Await `call()` or the call of `key` in flight, with `copy` every caller gets a result of its own."""
+        flight = self._flights.get(key)
+        if flight is None or flight.task.done():
+            flight = self._flights[key] = Flight(create_task(call()))
+            flight.task.add_done_callback(lambda _: self._land(key, flight))
+            self.started += 1
+        else:
+            self.joined += 1
+
+        flight.waiters += 1
+        try:
+            result = await shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                # Later callers must not join a call on its way out
+                flight.task.cancel()
+                self._land(key, flight)
+
+        return copy(result) if copy is not None else result
+
+    def _land(self, key: Hashable, flight: Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> dict[str, float]:
+        calls = self.started + self.joined
+        return {
+            'started': self.started,
+            'joined': self.joined,
+            'joined_ratio': self.joined / calls if calls else 0.0,
+            'in_flight': len(self._flights),
+        }
+
+
+@lru_cache
+def get_single_flight() -> SingleFlight:
+    return SingleFlight()
@@ -1,19 +1,47 @@
 from contextlib import asynccontextmanager
 
-from alembic.command import upgrade
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from starlette.middleware.cors import CORSMiddleware
 
-from app.api.routes import router
+from app.api.monitoring import router as monitoring_router
+from app.api.quotes import router as quote_router
+from app.api.routes import READ_ONLY_PATHS, router
+from app.api.stations import router as station_router
+from app.car_app.events import get_car_event_hub
+from app.core.admission import AdmissionMiddleware
 from app.core.config import get_settings
-from app.core.database import get_alembic_config
+from app.core.database import dispose_engines, warm_up_pool
+from app.core.metrics import MetricsMiddleware
+from app.core.migrations import check_database_revision
+from app.core.replicas import ReadYourWritesMiddleware
+from app.storage.deletions import get_deletion_worker
+from app.storage.images import get_image_executor
+from app.storage.s3 import get_s3
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    alembic_config = get_alembic_config(get_settings().DATABASE_URL)
-    upgrade(alembic_config, 'head')
-    yield
+    settings = get_settings()
+    if settings.DATABASE_CHECK_MIGRATIONS:
+        await check_database_revision()
+    await warm_up_pool(settings.DATABASE_WARMUP_CONNECTIONS)
+
+    s3 = get_s3()
+    await s3.connect()
+    await s3.warm_up(settings.AWS_S3_WARMUP_TIMEOUT)
+    deletion_worker = get_deletion_worker()
+    deletion_worker.start()
+    car_event_hub = get_car_event_hub()
+    car_event_hub.start()
+    try:
+        yield
+    finally:
+        await car_event_hub.stop()
+        await deletion_worker.stop()
+        await s3.close()
+        get_image_executor().shutdown(cancel_futures=True)
+        await dispose_engines()
 
 
 def create_app() -> FastAPI:
@@ -21,9 +49,21 @@ def create_app() -> FastAPI:
         title=get_settings().PROJECT_NAME,
         version='0.1.0',
         lifespan=lifespan,
+        default_response_class=ORJSONResponse,
     )
     application.include_router(router)
+    application.include_router(station_router)
+    application.include_router(quote_router)
+    application.include_router(monitoring_router)
 
+    application.add_middleware(
+        AdmissionMiddleware,
+        routes=application.routes,
+        limits=get_settings().ADMISSION_LIMITS,
+        default=(get_settings().ADMISSION_DEFAULT_CONCURRENCY, get_settings().ADMISSION_DEFAULT_QUEUE_SIZE),
+        queue_timeout=get_settings().ADMISSION_QUEUE_TIMEOUT,
+        retry_after=get_settings().ADMISSION_RETRY_AFTER,
+    )
     application.add_middleware(
         CORSMiddleware,
         allow_origins=['*'],
@@ -31,6 +71,13 @@ def create_app() -> FastAPI:
         allow_methods=['*'],
         allow_headers=['*'],
     )
+    # Installed without replicas too, shared reads and the car cache are skipped for a client that has just written
+    application.add_middleware(
+        ReadYourWritesMiddleware,
+        window=get_settings().DATABASE_READ_YOUR_WRITES_SECONDS,
+        read_only_paths=READ_ONLY_PATHS,
+    )
+    application.add_middleware(MetricsMiddleware, slow_request_seconds=get_settings().METRICS_SLOW_REQUEST_SECONDS)
 
     return application
 
@@ -1,6 +1,7 @@
 from datetime import datetime
 
-from sqlalchemy import CheckConstraint, DateTime, Enum, Float, Integer, String
+from sqlalchemy import CheckConstraint, DateTime, Enum, Float, Index, Integer, String, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.sql import func
 
@@ -10,10 +11,30 @@ from app.core.enums import Brand, CarStatuse, Category, Color, FuelType, Transmi
 
 class Car(Base):
     __tablename__ = 'cars'
+    __table_args__ = (
+        Index('ix_cars_status', 'status'),
+        Index('ix_cars_station_id_status_category', 'station_id', 'status', 'category'),
+        Index('ix_cars_free_station_id_category', 'station_id', 'category', postgresql_where=text("status = 'free'")),
+        Index('ix_cars_created_at_id', 'created_at', 'id'),
+        Index('ix_cars_number_trgm', 'number', postgresql_using='gin', postgresql_ops={'number': 'gin_trgm_ops'}),
+        Index(
+            'ix_cars_description_trgm',
+            'description',
+            postgresql_using='gin',
+            postgresql_ops={'description': 'gin_trgm_ops'},
+        ),
+        Index(
+            'ix_cars_image_variants',
+            'image_variants',
+            postgresql_using='gin',
+            postgresql_ops={'image_variants': 'jsonb_path_ops'},
+        ),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     number: Mapped[str] = mapped_column(String(length=16), unique=True, nullable=False)
     image: Mapped[str] = mapped_column(String(length=256), unique=True, nullable=True)
+    image_variants: Mapped[dict[str, str]] = mapped_column(JSONB, nullable=False, server_default=text("'{}'::jsonb"))
     brand: Mapped[str] = mapped_column(Enum(Brand), nullable=False)
     description: Mapped[str] = mapped_column(String(length=256), nullable=True)
     transmission: Mapped[str] = mapped_column(Enum(Transmission), nullable=False)
@@ -27,6 +48,7 @@ class Car(Base):
     status: Mapped[str] = mapped_column(Enum(CarStatuse), nullable=False, default=CarStatuse.free)
     station_id: Mapped[int] = mapped_column(Integer, nullable=False)
     cost_per_hour: Mapped[float] = mapped_column(Float, CheckConstraint('cost_per_hour > 0'), nullable=False)
+    version: Mapped[int] = mapped_column(Integer, nullable=False, server_default='1')
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
     )
@@ -0,0 +1,19 @@
+from datetime import datetime
+
+from sqlalchemy import DateTime, Index, Integer, String
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.sql import func
+
+from app.core.database import Base
+
+
+class ObjectDeletion(Base):
+    """S3 key that no row references anymore, written in the transaction that dropped the reference."""
+
+    __tablename__ = 'object_deletions'
+    __table_args__ = (Index('ix_object_deletions_available_at', 'available_at'),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    key: Mapped[str] = mapped_column(String(length=256), nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, server_default='0')
+    available_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
@@ -0,0 +1,29 @@
+from datetime import datetime
+
+from sqlalchemy import BigInteger, DateTime, Enum, Index, Integer
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.sql import func
+
+from app.core.database import Base
+from app.core.enums import CarEventType, CarStatuse
+
+
+class CarEvent(Base):
+    """Change of a car, written and announced with NOTIFY by triggers on `cars` in the transaction of the change.
+
+    `previous_station_id` and `previous_status` are set by updates only, so subscribers of the old station or status
+    learn that a car left it.
+    """
+
+    __tablename__ = 'car_events'
+    __table_args__ = (Index('ix_car_events_created_at', 'created_at'),)
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    car_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    type: Mapped[str] = mapped_column(Enum(CarEventType), nullable=False)
+    station_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    status: Mapped[str] = mapped_column(Enum(CarStatuse), nullable=False)
+    previous_station_id: Mapped[int] = mapped_column(Integer, nullable=True)
+    previous_status: Mapped[str] = mapped_column(Enum(CarStatuse), nullable=True)
+    version: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
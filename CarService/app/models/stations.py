@@ -0,0 +1,16 @@
+from sqlalchemy import Enum, Integer
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.core.database import Base
+from app.core.enums import CarStatuse, Category
+
+
+class StationCarCount(Base):
+    """Number of cars per station, status and category, kept up to date by statement triggers on `cars`."""
+
+    __tablename__ = 'station_car_counts'
+
+    station_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    status: Mapped[str] = mapped_column(Enum(CarStatuse), primary_key=True)
+    category: Mapped[str] = mapped_column(Enum(Category), primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, server_default='0')
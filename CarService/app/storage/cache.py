@@ -0,0 +1,49 @@
+from collections import OrderedDict
+from time import time
+
+
+class PresignedUrlCache:
+    """LRU cache of presigned URLs grouped into fixed time windows.
+
+    Every URL signed inside a window is reused until the window is over, so repeated
+    requests get byte-identical URLs that browsers and CDNs can cache. URLs signed for
+    different expiration times are kept apart.
+    """
+
+    def __init__(self, max_size: int, window: int):
+        self.max_size = max_size
+        self.window = window
+        self.hits = 0
+        self.misses = 0
+        self._urls: OrderedDict[tuple[str, str, int], dict[int, str]] = OrderedDict()
+
+    def current_window(self) -> int:
+        return int(time() // self.window)
+
+    def expires_in(self, window: int, expiration_time: int) -> int:
+        """Seconds a URL signed now must live to stay valid `expiration_time` after its window ends."""
+        return int((window + 1) * self.window + expiration_time - time())
+
+    def get(self, bucket: str, key: str, window: int, expiration_time: int) -> str | None:
+        url = self._urls.get((bucket, key, window), {}).get(expiration_time)
+        if url is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._urls.move_to_end((bucket, key, window))
+        return url
+
+    def set(self, bucket: str, key: str, window: int, expiration_time: int, url: str):
+        self._urls.setdefault((bucket, key, window), {})[expiration_time] = url
+        self._urls.move_to_end((bucket, key, window))
+        while len(self._urls) > self.max_size:
+            self._urls.popitem(last=False)
+
+    def invalidate(self, bucket: str, key: str):
+        window = self.current_window()
+        for cached_window in (window - 1, window):
+            self._urls.pop((bucket, key, cached_window), None)
+
+    def stats(self) -> dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._urls)}
@@ -0,0 +1,128 @@
+import logging
+from asyncio import create_task, Event, Task, wait_for
+from contextlib import suppress
+from functools import lru_cache
+
+from sqlalchemy import any_, bindparam, delete, func, select, String, update
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import get_settings
+from app.core.database import managed_session
+from app.core.enums import ImageSize
+from app.models.cars import Car
+from app.models.deletions import ObjectDeletion
+from app.storage.s3 import FileManager, get_s3
+
+logger = logging.getLogger(__name__)
+
+
+class DeletionWorker:
+    """Deletes the S3 keys queued in `object_deletions` in DeleteObjects batches.
+
+    Rows are claimed with FOR UPDATE SKIP LOCKED, so every worker process runs its own loop without deleting a key
+    twice. Keys S3 fails to delete are retried after a delay doubling with every attempt, up to `max_delay` seconds.
+    Keys a car references again are dropped from the queue without being deleted.
+    """
+
+    def __init__(self, file_manager: FileManager, batch_size: int = 1000, interval: float = 1, max_delay: int = 3600):
+        self.file_manager = file_manager
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_delay = max_delay
+
+        self._stopping: Event | None = None
+        self._task: Task | None = None
+
+    def start(self):
+        if self._task is None:
+            self._stopping = Event()
+            self._task = create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+
+        self._stopping.set()
+        task, self._task = self._task, None
+        await task
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                processed = await self.delete_batch()
+            except Exception as err:
+                logger.error(f'Cannot process queued S3 deletions, err={err}')
+                processed = 0
+
+            # A full batch means more keys are probably waiting, so the next one starts right away
+            if processed < self.batch_size:
+                with suppress(TimeoutError):
+                    await wait_for(self._stopping.wait(), self.interval)
+
+    async def delete_batch(self) -> int:
+        async with managed_session() as session:
+            query = (
+                select(ObjectDeletion.id, ObjectDeletion.key)
+                .where(ObjectDeletion.available_at <= func.now())
+                .order_by(ObjectDeletion.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            deletions = (await session.execute(query)).all()
+            if not deletions:
+                return 0
+
+            # A car that took a key over unqueues it, unless the key was claimed here before that car committed
+            referenced_keys = await self._referenced_keys(session, list({deletion.key for deletion in deletions}))
+            keys = list({deletion.key for deletion in deletions if deletion.key not in referenced_keys})
+
+            failed_keys = await self.file_manager.delete_keys(keys) if keys else []
+            if failed_keys is None:
+                failed_keys = keys
+            failed_keys = set(failed_keys)
+
+            deleted_ids = [deletion.id for deletion in deletions if deletion.key not in failed_keys]
+            failed_ids = [deletion.id for deletion in deletions if deletion.key in failed_keys]
+
+            if deleted_ids:
+                await session.execute(delete(ObjectDeletion).where(ObjectDeletion.id.in_(deleted_ids)))
+            if failed_ids:
+                logger.warning(f'Cannot delete {len(failed_ids)} S3 objects, retrying later')
+                delay = func.least(func.power(2, ObjectDeletion.attempts), self.max_delay)
+                await session.execute(
+                    update(ObjectDeletion)
+                    .where(ObjectDeletion.id.in_(failed_ids))
+                    .values(
+                        attempts=ObjectDeletion.attempts + 1,
+                        available_at=func.now() + func.make_interval(0, 0, 0, 0, 0, 0, delay),
+                    )
+                )
+
+        return len(deletions)
+
+    @staticmethod
+    async def _referenced_keys(session: AsyncSession, keys: list[str]) -> set[str]:
+        """Keys out of `keys` used as an image or an image variant by a car."""
+        images = select(Car.image).where(Car.image == any_(bindparam('keys', type_=ARRAY(String))))
+        referenced = set((await session.execute(images, {'keys': keys})).scalars())
+
+        # A containment per size and key, so the GIN index of image_variants finds the cars without a scan
+        documents = [{size: key} for key in keys for size in ImageSize if size is not ImageSize.original]
+        variants = select(Car.image_variants).where(
+            Car.image_variants.op('@>')(any_(bindparam('documents', type_=ARRAY(JSONB))))
+        )
+        candidates = set(keys)
+        for image_variants in (await session.execute(variants, {'documents': documents})).scalars():
+            referenced.update(key for key in image_variants.values() if key in candidates)
+        return referenced
+
+
+@lru_cache
+def get_deletion_worker() -> DeletionWorker:
+    return DeletionWorker(
+        file_manager=get_s3(),
+        batch_size=get_settings().IMAGE_DELETION_BATCH_SIZE,
+        interval=get_settings().IMAGE_DELETION_INTERVAL,
+        max_delay=get_settings().IMAGE_DELETION_MAX_DELAY,
+    )
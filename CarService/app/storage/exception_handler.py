@@ -1,4 +1,6 @@
 import logging
+from functools import wraps
+from inspect import iscoroutinefunction
 from typing import Any, Callable
 
 from boto3.exceptions import Boto3Error
@@ -12,6 +14,19 @@ class Boto3ErrorHandler:
         self.return_value = return_value
 
     def __call__(self, function: Callable):
+        if iscoroutinefunction(function):
+
+            @wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                try:
+                    return await function(*args, **kwargs)
+                except (ClientError, Boto3Error) as e:
+                    logger.error(str(e))
+                    return self.return_value
+
+            return async_wrapper
+
+        @wraps(function)
         def wrapper(*args, **kwargs):
             try:
                 return function(*args, **kwargs)
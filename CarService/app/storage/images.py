@@ -0,0 +1,61 @@
+from asyncio import get_running_loop
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+from multiprocessing import get_context
+
+from PIL import Image, ImageOps
+
+from app.core.config import get_settings
+from app.core.enums import ImageSize
+from app.core.exceptions import UploadFileError
+from app.core.metrics import timed_phase
+
+VARIANT_WIDTHS = {
+    ImageSize.thumbnail: 320,
+    ImageSize.medium: 960,
+}
+WEBP_QUALITY = 80
+
+
+def variant_key(file_name: str, size: ImageSize) -> str:
+    # The whole key is kept, extension included, so two originals that only differ in it never share a variant.
+    # Original keys are unique across cars, so the variants of one car are never released by another.
+    return f'variants/{size}/{file_name}.webp'
+
+
+def variant_keys(file_name: str) -> dict[ImageSize, str]:
+    return {size: variant_key(file_name, size) for size in VARIANT_WIDTHS}
+
+
+def render_variants(data: bytes) -> dict[ImageSize, bytes]:
+    """Resize an image into every variant size and encode them as WebP, runs in a worker process."""
+    variants = {}
+    with Image.open(BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+
+        for size, width in VARIANT_WIDTHS.items():
+            variant = image.copy()
+            variant.thumbnail((width, width))
+
+            buffer = BytesIO()
+            variant.save(buffer, format='WEBP', quality=WEBP_QUALITY)
+            variants[size] = buffer.getvalue()
+
+    return variants
+
+
+@lru_cache
+def get_image_executor() -> ProcessPoolExecutor:
+    # Forking a process that runs an event loop is unsafe, workers are spawned from scratch instead
+    return ProcessPoolExecutor(max_workers=get_settings().IMAGE_PROCESS_WORKERS, mp_context=get_context('spawn'))
+
+
+async def create_variants(data: bytes) -> dict[ImageSize, bytes]:
+    try:
+        with timed_phase('images'):
+            return await get_running_loop().run_in_executor(get_image_executor(), render_variants, data)
+    except (OSError, ValueError, Image.DecompressionBombError) as err:
+        raise UploadFileError(f'Cannot decode image, err={err}', status_code=415)
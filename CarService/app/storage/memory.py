@@ -0,0 +1,56 @@
+from urllib.parse import quote
+
+from fastapi import UploadFile
+
+from app.storage.cache import PresignedUrlCache
+from app.storage.s3 import EXPIRATION_TIME, FileManager
+from app.storage.uploads import LimitedStream
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class InMemoryFileManager(FileManager):
+    """FileManager keeping objects in a dict, a stand-in for S3 in benchmarks and local runs without a bucket.
+
+    URLs are cached the same way S3Manager caches presigned URLs, so ETags and cache stats behave alike.
+    """
+
+    def __init__(self, bucket: str = 'cars', url_cache: PresignedUrlCache | None = None):
+        self.bucket = bucket
+        self.url_cache = url_cache or PresignedUrlCache(max_size=1024, window=EXPIRATION_TIME // 4)
+        self.objects: dict[str, tuple[bytes, str | None]] = {}
+
+    async def create_presigned_url(self, file_name: str | None, expiration_time: int = EXPIRATION_TIME) -> str | None:
+        if file_name is None:
+            return None
+
+        window = self.url_cache.current_window()
+        url = self.url_cache.get(self.bucket, file_name, window, expiration_time)
+        if url is not None:
+            return url
+
+        expires_in = self.url_cache.expires_in(window, expiration_time)
+        url = f'memory://{self.bucket}/{quote(file_name)}?expires_in={expires_in}'
+        self.url_cache.set(self.bucket, file_name, window, expiration_time, url)
+        return url
+
+    async def upload_file(
+        self, file: UploadFile | LimitedStream, file_name: str, content_type: str | None = None
+    ) -> bool:
+        data = bytearray()
+        while chunk := await file.read(READ_CHUNK_SIZE):
+            data += chunk
+
+        self.objects[file_name] = (bytes(data), content_type)
+        self.url_cache.invalidate(self.bucket, file_name)
+        return True
+
+    async def delete_objects(self, file_name: str) -> bool:
+        self.objects.pop(file_name, None)
+        self.url_cache.invalidate(self.bucket, file_name)
+        return True
+
+    async def delete_keys(self, keys: list[str]) -> list[str] | None:
+        for key in keys:
+            await self.delete_objects(key)
+        return []
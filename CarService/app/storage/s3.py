@@ -1,69 +1,222 @@
+import logging
+from asyncio import Semaphore, timeout
+from contextlib import asynccontextmanager, AsyncExitStack, contextmanager
 from functools import lru_cache
-from typing import Protocol
+from time import perf_counter
+from typing import AsyncIterator, Iterator, Protocol
 
 from aioboto3 import Session
 from botocore.client import BaseClient
 from botocore.config import Config
+from botocore.exceptions import BotoCoreError
 from fastapi import UploadFile
+from s3transfer.manager import TransferConfig
 
 from app.core.config import get_settings
+from app.core.metrics import add_phase_time, S3_OPERATION_ERRORS, S3_OPERATION_SECONDS
+from app.storage.cache import PresignedUrlCache
 from app.storage.exception_handler import Boto3ErrorHandler
+from app.storage.uploads import LimitedStream
+
+logger = logging.getLogger(__name__)
 
 EXPIRATION_TIME = 60 * 60
+DELETE_OBJECTS_LIMIT = 1000
 
 
 class FileManager(Protocol):
     @Boto3ErrorHandler()
-    async def create_presigned_url(self, file_name: str, expiration_time: int = EXPIRATION_TIME) -> str | None: ...
+    async def create_presigned_url(
+        self, file_name: str | None, expiration_time: int = EXPIRATION_TIME
+    ) -> str | None: ...
 
     @Boto3ErrorHandler(return_value=False)
-    async def upload_file(self, file: UploadFile, file_name: str) -> bool: ...
+    async def upload_file(
+        self, file: UploadFile | LimitedStream, file_name: str, content_type: str | None = None
+    ) -> bool: ...
 
     @Boto3ErrorHandler(return_value=False)
     async def delete_objects(self, file_name: str) -> bool: ...
 
+    @Boto3ErrorHandler()
+    async def delete_keys(self, keys: list[str]) -> list[str] | None: ...
+
 
 class S3Manager(FileManager):
-    def __init__(self, bucket: str, endpoint_url: str):
+    def __init__(
+        self,
+        bucket: str,
+        endpoint_url: str,
+        max_pool_connections: int = 10,
+        tcp_keepalive: bool = False,
+        url_cache: PresignedUrlCache | None = None,
+        upload_part_size: int = 8 * 1024 * 1024,
+        upload_concurrency: int = 4,
+        max_concurrency: int = 50,
+    ):
         self.bucket = bucket
         self.endpoint_url = endpoint_url
+        self.max_pool_connections = max_pool_connections
+        self.tcp_keepalive = tcp_keepalive
+        self.url_cache = url_cache or PresignedUrlCache(max_size=1024, window=EXPIRATION_TIME // 4)
+        # Parts are read from the file while earlier ones are uploaded, so at most
+        # 2 * upload_concurrency parts of an upload are held in memory at once
+        self.transfer_config = TransferConfig(
+            multipart_threshold=upload_part_size,
+            multipart_chunksize=upload_part_size,
+            max_request_concurrency=upload_concurrency,
+            max_io_queue_size=upload_concurrency,
+        )
+
+        # Shared by all requests of the worker, so a burst of signing or uploads queues here instead of piling up on
+        # the HTTP connection pool and slowing down every other S3 call
+        self._slots = Semaphore(max_concurrency)
+
+        self._client: BaseClient | None = None
+        self._exit_stack: AsyncExitStack | None = None
+
+    async def connect(self):
+        if self._client is not None:
+            return
 
-    @property
-    def __session_s3_client(self) -> BaseClient:
         session = Session()
         session_client = session.client(
             service_name='s3',
-            config=Config(signature_version='s3v4'),
+            config=Config(
+                signature_version='s3v4',
+                max_pool_connections=self.max_pool_connections,
+                tcp_keepalive=self.tcp_keepalive,
+            ),
             endpoint_url=self.endpoint_url,
         )
-        return session_client
+
+        exit_stack = AsyncExitStack()
+        self._client = await exit_stack.enter_async_context(session_client)
+        self._exit_stack = exit_stack
+
+    async def close(self):
+        if self._exit_stack is None:
+            return
+
+        exit_stack, self._exit_stack, self._client = self._exit_stack, None, None
+        await exit_stack.aclose()
+
+    @Boto3ErrorHandler(return_value=False)
+    async def warm_up(self, warmup_timeout: float) -> bool:
+        """Resolve credentials and open a pooled connection to the bucket before the first request needs one.
+
+        Warming up only saves the first request some time, so an unreachable or slow endpoint and missing credentials
+        are logged instead of failing the startup.
+        """
+        try:
+            async with timeout(warmup_timeout), self._limited('head_bucket'):
+                await self._s3_client.head_bucket(Bucket=self.bucket)
+        except (BotoCoreError, TimeoutError) as err:
+            logger.warning(f'Cannot warm up the S3 connection, err={err!r}')
+            return False
+        return True
+
+    @property
+    def _s3_client(self) -> BaseClient:
+        if self._client is None:
+            raise RuntimeError('S3 client is not connected, call S3Manager.connect() first')
+        return self._client
 
     @Boto3ErrorHandler()
-    async def create_presigned_url(self, file_name: str, expiration_time: int = EXPIRATION_TIME) -> str | None:
-        async with self.__session_s3_client as s3:
-            presigned_url = await s3.generate_presigned_url(
+    async def create_presigned_url(self, file_name: str | None, expiration_time: int = EXPIRATION_TIME) -> str | None:
+        # Cars imported without an image have no key, botocore rejects a None key before any error handler sees it
+        if file_name is None:
+            return None
+
+        window = self.url_cache.current_window()
+        presigned_url = self.url_cache.get(self.bucket, file_name, window, expiration_time)
+        if presigned_url is not None:
+            return presigned_url
+
+        async with self._limited('presign'):
+            presigned_url = await self._s3_client.generate_presigned_url(
                 ClientMethod='get_object',
                 Params={'Bucket': self.bucket, 'Key': file_name},
-                ExpiresIn=expiration_time,
+                ExpiresIn=self.url_cache.expires_in(window, expiration_time),
             )
+        self.url_cache.set(self.bucket, file_name, window, expiration_time, presigned_url)
         return presigned_url
 
     @Boto3ErrorHandler(return_value=False)
-    async def upload_file(self, file: UploadFile, file_name: str) -> bool:
-        async with self.__session_s3_client as s3:
-            await s3.upload_fileobj(file, Key=file_name, Bucket=self.bucket)
+    async def upload_file(
+        self, file: UploadFile | LimitedStream, file_name: str, content_type: str | None = None
+    ) -> bool:
+        async with self._limited('upload'):
+            await self._s3_client.upload_fileobj(
+                file,
+                Key=file_name,
+                Bucket=self.bucket,
+                ExtraArgs={'ContentType': content_type} if content_type else None,
+                Config=self.transfer_config,
+            )
+        self.url_cache.invalidate(self.bucket, file_name)
         return True
 
     @Boto3ErrorHandler(return_value=False)
     async def delete_objects(self, file_name: str) -> bool:
-        async with self.__session_s3_client as s3:
-            await s3.delete_object(Bucket=self.bucket, Key=file_name)
+        async with self._limited('delete'):
+            await self._s3_client.delete_object(Bucket=self.bucket, Key=file_name)
+        self.url_cache.invalidate(self.bucket, file_name)
         return True
 
+    @Boto3ErrorHandler()
+    async def delete_keys(self, keys: list[str]) -> list[str] | None:
+        """Delete keys with DeleteObjects calls of up to 1000 keys, returns the keys S3 failed to delete."""
+        keys = list(dict.fromkeys(keys))
+
+        failed = []
+        for start in range(0, len(keys), DELETE_OBJECTS_LIMIT):
+            chunk = keys[start : start + DELETE_OBJECTS_LIMIT]
+            async with self._limited('delete_many'):
+                response = await self._s3_client.delete_objects(
+                    Bucket=self.bucket, Delete={'Objects': [{'Key': key} for key in chunk], 'Quiet': True}
+                )
+            failed += [error['Key'] for error in response.get('Errors', [])]
+
+        for key in keys:
+            self.url_cache.invalidate(self.bucket, key)
+        return failed
+
+    @asynccontextmanager
+    async def _limited(self, operation: str) -> AsyncIterator[None]:
+        started = perf_counter()
+        async with self._slots:
+            add_phase_time('s3_wait', perf_counter() - started)
+            with _observed(operation):
+                yield
+
+
+@contextmanager
+def _observed(operation: str) -> Iterator[None]:
+    started = perf_counter()
+    try:
+        yield
+    except Exception:
+        S3_OPERATION_ERRORS.inc(operation=operation)
+        raise
+    finally:
+        seconds = perf_counter() - started
+        S3_OPERATION_SECONDS.observe(seconds, operation=operation)
+        add_phase_time('s3', seconds)
+
 
 @lru_cache
 def get_s3() -> S3Manager:
     return S3Manager(
         bucket=get_settings().AWS_S3_CARS_BUCKET_NAME,
         endpoint_url=get_settings().AWS_S3_ENDPOINT_URL,
+        max_pool_connections=get_settings().AWS_S3_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=get_settings().AWS_S3_TCP_KEEPALIVE,
+        url_cache=PresignedUrlCache(
+            max_size=get_settings().AWS_S3_PRESIGNED_URL_CACHE_SIZE,
+            window=get_settings().AWS_S3_PRESIGNED_URL_WINDOW,
+        ),
+        upload_part_size=get_settings().AWS_S3_UPLOAD_PART_SIZE,
+        upload_concurrency=get_settings().AWS_S3_UPLOAD_CONCURRENCY,
+        max_concurrency=get_settings().AWS_S3_MAX_CONCURRENCY,
     )
@@ -0,0 +1,34 @@
+from typing import AsyncIterator
+
+from app.core.exceptions import UploadFileError
+
+
+class LimitedStream:
+    """File-like reader over an async byte stream that fails as soon as more than `max_size` bytes arrive."""
+
+    def __init__(self, chunks: AsyncIterator[bytes], max_size: int):
+        self.max_size = max_size
+        self.size = 0
+
+        self._chunks = chunks
+        self._buffer = bytearray()
+        self._exhausted = False
+
+    async def read(self, size: int = -1) -> bytes:
+        while not self._exhausted and (size < 0 or len(self._buffer) < size):
+            try:
+                chunk = await anext(self._chunks)
+            except StopAsyncIteration:
+                self._exhausted = True
+                break
+
+            self.size += len(chunk)
+            if self.size > self.max_size:
+                raise UploadFileError(f'Image is larger than {self.max_size} bytes', status_code=413)
+            self._buffer += chunk
+
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
@@ -7,6 +7,9 @@ from sqlalchemy import engine_from_config, pool
 from app.core.config import get_settings
 from app.core.database import Base
 from app.models.cars import Car  # noqa
+from app.models.deletions import ObjectDeletion  # noqa
+from app.models.events import CarEvent  # noqa
+from app.models.stations import StationCarCount  # noqa
 
 config = context.config
 
@@ -0,0 +1,50 @@
+"""Add_car_search_indexes
+
+Revision ID: 19fdacf54828
+Revises: b6e09c8b73d3
+Create Date: 2026-10-18 23:12:40.518236
+
+"""
+import logging
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '19fdacf54828'
+down_revision: Union[str, None] = 'b6e09c8b73d3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+def upgrade() -> None:
+    # The extension ships with the contrib modules of Postgres, creating it needs the CREATE privilege on the database.
+    # Builds without them, like the embedded server of the benchmark, get no indexes and search falls back to ILIKE.
+    available = sa.text("SELECT EXISTS (SELECT FROM pg_available_extensions WHERE name = 'pg_trgm')")
+    if not op.get_bind().scalar(available):
+        logger.warning(
+            'pg_trgm is not available, car search falls back to unranked ILIKE without indexes. Install the contrib '
+            'modules of Postgres and run `alembic downgrade b6e09c8b73d3 && alembic upgrade head` to add them'
+        )
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index(
+        'ix_cars_number_trgm', 'cars', ['number'], unique=False,
+        postgresql_using='gin', postgresql_ops={'number': 'gin_trgm_ops'}
+    )
+    op.create_index(
+        'ix_cars_description_trgm', 'cars', ['description'], unique=False,
+        postgresql_using='gin', postgresql_ops={'description': 'gin_trgm_ops'}
+    )
+
+
+def downgrade() -> None:
+    # The indexes are missing if pg_trgm was not available on upgrade
+    op.execute('DROP INDEX IF EXISTS ix_cars_description_trgm')
+    op.execute('DROP INDEX IF EXISTS ix_cars_number_trgm')
+    # The extension is left in place, other objects of the database may use it as well
@@ -0,0 +1,28 @@
+"""Add_car_image_variants_index
+
+Revision ID: 3f1c8e2a9d47
+Revises: 19fdacf54828
+Create Date: 2026-10-19 10:24:07.913842
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c8e2a9d47'
+down_revision: Union[str, None] = '19fdacf54828'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # jsonb_path_ops serves the containment lookups of the deletion worker, which checks keys against the variants
+    op.create_index(
+        'ix_cars_image_variants', 'cars', ['image_variants'], unique=False,
+        postgresql_using='gin', postgresql_ops={'image_variants': 'jsonb_path_ops'}
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_cars_image_variants', table_name='cars', postgresql_using='gin')
@@ -0,0 +1,32 @@
+"""Add_car_image_variants
+
+Revision ID: 512799293231
+Revises: fd021ee59cf0
+Create Date: 2026-10-18 18:31:05.271944
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '512799293231'
+down_revision: Union[str, None] = 'fd021ee59cf0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'cars',
+        sa.Column(
+            'image_variants', postgresql.JSONB(astext_type=sa.Text()), server_default=sa.text("'{}'::jsonb"),
+            nullable=False
+        )
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('cars', 'image_variants')
@@ -0,0 +1,34 @@
+"""Add_car_lookup_indexes
+
+Revision ID: 52c64f9bb6c9
+Revises: eb713b7033ef
+Create Date: 2026-10-18 17:40:12.381604
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '52c64f9bb6c9'
+down_revision: Union[str, None] = 'eb713b7033ef'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_cars_status', 'cars', ['status'], unique=False)
+    op.create_index('ix_cars_station_id_status_category', 'cars', ['station_id', 'status', 'category'], unique=False)
+    op.create_index(
+        'ix_cars_free_station_id_category', 'cars', ['station_id', 'category'], unique=False,
+        postgresql_where=sa.text("status = 'free'")
+    )
+    op.create_index('ix_cars_created_at_id', 'cars', ['created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_cars_created_at_id', table_name='cars')
+    op.drop_index('ix_cars_free_station_id_category', table_name='cars', postgresql_where=sa.text("status = 'free'"))
+    op.drop_index('ix_cars_station_id_status_category', table_name='cars')
+    op.drop_index('ix_cars_status', table_name='cars')
@@ -0,0 +1,34 @@
+"""Add_object_deletions
+
+Revision ID: 6c1f0e93a4d2
+Revises: 512799293231
+Create Date: 2026-10-18 19:52:41.318604
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '6c1f0e93a4d2'
+down_revision: Union[str, None] = '512799293231'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'object_deletions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('key', sa.String(length=256), nullable=False),
+        sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('available_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_object_deletions_available_at', 'object_deletions', ['available_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_object_deletions_available_at', table_name='object_deletions')
+    op.drop_table('object_deletions')
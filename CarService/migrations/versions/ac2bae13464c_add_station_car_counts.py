@@ -0,0 +1,89 @@
+"""Add_station_car_counts
+
+Revision ID: ac2bae13464c
+Revises: 6c1f0e93a4d2
+Create Date: 2026-10-18 21:14:05.472913
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'ac2bae13464c'
+down_revision: Union[str, None] = '6c1f0e93a4d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Statement triggers see every row a statement changed at once, so a bulk status update or a COPY import writes each
+# counter once. Groups netting to zero, like an update that kept the station, status and category, are not written,
+# and counters are upserted in key order, so concurrent writers lock them in the same order and cannot deadlock.
+COUNT_FUNCTION = """
+CREATE FUNCTION {name}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO station_car_counts AS counts (station_id, status, category, count)
+    SELECT station_id, status, category, sum(delta) FROM ({changes}) AS changes
+    GROUP BY station_id, status, category
+    HAVING sum(delta) <> 0
+    ORDER BY station_id, status, category
+    ON CONFLICT (station_id, status, category) DO UPDATE SET count = counts.count + excluded.count;
+    RETURN NULL;
+END;
+$$
+"""
+NEW_ROWS = 'SELECT station_id, status, category, 1 AS delta FROM new_rows'
+OLD_ROWS = 'SELECT station_id, status, category, -1 AS delta FROM old_rows'
+
+# Trigger name, function name, event, transition tables and the changes the function counts
+TRIGGERS = [
+    ('cars_count_inserted', 'count_inserted_cars', 'INSERT', 'NEW TABLE AS new_rows', NEW_ROWS),
+    (
+        'cars_count_updated',
+        'count_updated_cars',
+        'UPDATE',
+        'OLD TABLE AS old_rows NEW TABLE AS new_rows',
+        f'{NEW_ROWS} UNION ALL {OLD_ROWS}',
+    ),
+    ('cars_count_deleted', 'count_deleted_cars', 'DELETE', 'OLD TABLE AS old_rows', OLD_ROWS),
+]
+
+
+def upgrade() -> None:
+    op.create_table(
+        'station_car_counts',
+        sa.Column('station_id', sa.Integer(), nullable=False),
+        sa.Column('status', postgresql.ENUM(name='carstatuse', create_type=False), nullable=False),
+        sa.Column('category', postgresql.ENUM(name='category', create_type=False), nullable=False),
+        sa.Column('count', sa.Integer(), server_default='0', nullable=False),
+        sa.PrimaryKeyConstraint('station_id', 'status', 'category')
+    )
+    for trigger, function, event, transition_tables, changes in TRIGGERS:
+        op.execute(COUNT_FUNCTION.format(name=function, changes=changes))
+        op.execute(
+            f'CREATE TRIGGER {trigger} AFTER {event} ON cars REFERENCING {transition_tables} '
+            f'FOR EACH STATEMENT EXECUTE FUNCTION {function}()'
+        )
+    op.execute(
+        'CREATE FUNCTION clear_station_car_counts() RETURNS trigger LANGUAGE plpgsql AS $$ '
+        'BEGIN DELETE FROM station_car_counts; RETURN NULL; END; $$'
+    )
+    op.execute(
+        'CREATE TRIGGER cars_count_truncated AFTER TRUNCATE ON cars '
+        'FOR EACH STATEMENT EXECUTE FUNCTION clear_station_car_counts()'
+    )
+
+    op.execute(
+        'INSERT INTO station_car_counts (station_id, status, category, count) '
+        'SELECT station_id, status, category, count(*) FROM cars GROUP BY station_id, status, category'
+    )
+
+
+def downgrade() -> None:
+    op.execute('DROP TRIGGER cars_count_truncated ON cars')
+    op.execute('DROP FUNCTION clear_station_car_counts()')
+    for trigger, function, *_ in TRIGGERS:
+        op.execute(f'DROP TRIGGER {trigger} ON cars')
+        op.execute(f'DROP FUNCTION {function}()')
+    op.drop_table('station_car_counts')
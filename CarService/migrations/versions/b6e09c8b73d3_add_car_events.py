@@ -0,0 +1,109 @@
+"""Add_car_events
+
+Revision ID: b6e09c8b73d3
+Revises: ac2bae13464c
+Create Date: 2026-10-18 22:03:51.902674
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6e09c8b73d3'
+down_revision: Union[str, None] = 'ac2bae13464c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Events are announced in chunks, a NOTIFY payload must stay under 8000 bytes and an event takes about 200
+NOTIFY_CHUNK_SIZE = 32
+
+# Notifications are delivered when the transaction commits, and not at all if it rolls back
+EVENT_FUNCTION = """
+CREATE FUNCTION {name}() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    payloads text[];
+    payload text;
+BEGIN
+    WITH events AS (
+        INSERT INTO car_events (car_id, type, station_id, status, previous_station_id, previous_status, version)
+        {changes}
+        RETURNING id, car_id, type, station_id, status, previous_station_id, previous_status, version
+    ), numbered AS (
+        SELECT *, (row_number() OVER (ORDER BY id) - 1) / {chunk_size} AS chunk FROM events
+    )
+    SELECT array_agg(events_json ORDER BY chunk) INTO payloads FROM (
+        SELECT chunk, json_agg(json_build_object(
+            'id', id, 'car_id', car_id, 'type', type, 'station_id', station_id, 'status', status,
+            'previous_station_id', previous_station_id, 'previous_status', previous_status, 'version', version
+        ) ORDER BY id)::text AS events_json
+        FROM numbered GROUP BY chunk
+    ) AS chunks;
+
+    FOREACH payload IN ARRAY coalesce(payloads, '{{}}') LOOP
+        PERFORM pg_notify('car_events', payload);
+    END LOOP;
+    RETURN NULL;
+END;
+$$
+"""
+
+# Trigger name, function name, event, transition tables and the events the function records
+TRIGGERS = [
+    (
+        'cars_event_inserted',
+        'record_inserted_cars',
+        'INSERT',
+        'NEW TABLE AS new_rows',
+        "SELECT id, 'created', station_id, status, NULL, NULL, version FROM new_rows",
+    ),
+    (
+        'cars_event_updated',
+        'record_updated_cars',
+        'UPDATE',
+        'OLD TABLE AS old_rows NEW TABLE AS new_rows',
+        "SELECT car.id, 'updated', car.station_id, car.status, previous.station_id, previous.status, car.version "
+        'FROM new_rows AS car JOIN old_rows AS previous ON car.id = previous.id WHERE car IS DISTINCT FROM previous',
+    ),
+    (
+        'cars_event_deleted',
+        'record_deleted_cars',
+        'DELETE',
+        'OLD TABLE AS old_rows',
+        "SELECT id, 'deleted', station_id, status, NULL, NULL, version FROM old_rows",
+    ),
+]
+
+
+def upgrade() -> None:
+    op.create_table(
+        'car_events',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('car_id', sa.Integer(), nullable=False),
+        sa.Column('type', sa.Enum('created', 'updated', 'deleted', name='careventtype'), nullable=False),
+        sa.Column('station_id', sa.Integer(), nullable=False),
+        sa.Column('status', postgresql.ENUM(name='carstatuse', create_type=False), nullable=False),
+        sa.Column('previous_station_id', sa.Integer(), nullable=True),
+        sa.Column('previous_status', postgresql.ENUM(name='carstatuse', create_type=False), nullable=True),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_car_events_created_at', 'car_events', ['created_at'], unique=False)
+    for trigger, function, event, transition_tables, changes in TRIGGERS:
+        op.execute(EVENT_FUNCTION.format(name=function, changes=changes, chunk_size=NOTIFY_CHUNK_SIZE))
+        op.execute(
+            f'CREATE TRIGGER {trigger} AFTER {event} ON cars REFERENCING {transition_tables} '
+            f'FOR EACH STATEMENT EXECUTE FUNCTION {function}()'
+        )
+
+
+def downgrade() -> None:
+    for trigger, function, *_ in TRIGGERS:
+        op.execute(f'DROP TRIGGER {trigger} ON cars')
+        op.execute(f'DROP FUNCTION {function}()')
+    op.drop_index('ix_car_events_created_at', table_name='car_events')
+    op.drop_table('car_events')
+    sa.Enum(name='careventtype').drop(op.get_bind())
@@ -0,0 +1,25 @@
+"""Add_car_version
+
+Revision ID: fd021ee59cf0
+Revises: 52c64f9bb6c9
+Create Date: 2026-10-18 18:02:47.915230
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'fd021ee59cf0'
+down_revision: Union[str, None] = '52c64f9bb6c9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('cars', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('cars', 'version')
@@ -0,0 +1,341 @@
+"""Drive every API route at a fixed concurrency against seeded fleets and report latency percentiles as JSON.
+
+    python -m scripts.benchmark --fleet 1000 10000 --requests 200 --concurrency 16 --output benchmark.json
+
+The app is served in-process through httpx.ASGITransport with S3 replaced by InMemoryFileManager, so only Postgres
+is needed. DATABASE_URL must point at a local database upgraded with `make upgrade`. Without one, pass
+`--embedded-postgres DIR` to start a throwaway server from the `pgserver` package in DIR and migrate it. Its build has
+no pg_trgm, so the search route is measured on the ILIKE fallback there, without trigram indexes.
+
+Requests are generated from `--seed`, so two commits run with the same arguments get the same workload and their
+reports can be diffed. Seeded and created cars are deleted after every fleet.
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime, timedelta, timezone
+from io import BytesIO, StringIO
+from pathlib import Path
+from random import Random
+from statistics import quantiles
+from time import perf_counter
+from typing import Awaitable, Callable
+
+from httpx import ASGITransport, AsyncClient, Response
+from PIL import Image
+from sqlalchemy import delete, select, update
+
+from scripts.explain_indexes import seed, SEED_PREFIX
+
+from app.api.quotes import router as quote_router
+from app.api.routes import router
+from app.api.stations import router as station_router
+from app.car_app.cache import get_car_cache
+from app.core.database import _async_engine, warm_up_pool
+from app.core.enums import Brand, CarStatuse, Category, Color, FuelType, Transmission
+from app.core.migrations import check_database_revision
+from app.models.cars import Car
+from app.storage.deletions import DeletionWorker
+from app.storage.images import get_image_executor
+from app.storage.memory import InMemoryFileManager
+from app.storage.s3 import get_s3
+
+BATCH_SIZE = 50
+IMPORT_ROWS = 50
+QUOTE_HOURS = (3, 12, 24, 48, 96, 240)
+
+
+class Fleet:
+    """Cars the requests pick from, cars created by earlier routes are kept for the routes that update them."""
+
+    def __init__(self, cars: list[tuple[int, str]], random: Random):
+        self.cars = cars
+        self.car_ids = [car_id for car_id, _ in cars]
+        self.created: list[tuple[int, str]] = []
+        self.random = random
+        self.image = _png_image()
+
+    def car_form(self, number: str) -> dict[str, str]:
+        return {
+            'number': number,
+            'brand': self.random.choice(list(Brand)),
+            'year': str(self.random.randint(2000, 2023)),
+            'status': CarStatuse.free,
+            'transmission': self.random.choice(list(Transmission)),
+            'fuel_type': self.random.choice(list(FuelType)),
+            'color': self.random.choice(list(Color)),
+            'category': self.random.choice(list(Category)),
+            'engine_capacity': str(self.random.randint(10, 50) / 10),
+            'station_id': str(self.random.randint(1, 50)),
+            'cost_per_hour': str(self.random.randint(5, 100)),
+        }
+
+    def updated_car(self, request: int) -> tuple[int, str]:
+        cars = self.created or self.cars
+        return cars[request % len(cars)]
+
+
+async def list_cars(client: AsyncClient, fleet: Fleet, request: int) -> Response:
+    params = {'station_id': fleet.random.randint(1, 50), 'status': CarStatuse.free, 'limit': 50}
+    return await client.get('/cars', params=params)
+
+
+async def search_cars(client: AsyncClient, fleet: Fleet, request: int) -> Response:
+    _, number = fleet.random.choice(fleet.cars)
+    return await client.get('/cars/search', params={'q': number[-4:], 'limit': 20})
+
+
+async def export_cars(client: AsyncClient, fleet: Fleet, request: int) -> Response:
+    return await client.get('/cars/export', params={'station_id': fleet.random.randint(1, 50), 'format': 'csv'})
+
+
+async def get_car(client: AsyncClient, fleet: Fleet, request: int) -> Response:
+    return await client.get(f'/cars/{fleet.random.choice(fleet.car_ids)}')
+
+
+async def create_car(client: AsyncClient, fleet: Fleet, request: int) -> Response:
+    form = fleet.car_form(f'{SEED_PREFIX}P{request}')
+    response = await client.post('/cars', data=form, files={'image': ('car.png', fleet.image, 'image/png')})
+    if response.status_code == 200:
+        fleet.created.append((response.json()['id'], form['number']))
+    return response
+
+
+async def import_cars(client: AsyncClient, fleet: Fleet, request: int) -> Response:
+    buffer = StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(fleet.car_form('')))
+    writer.writeheader()
+    writer.writerows(fleet.car_form(f'{SEED_PREFIX}I{request}-{row}') for row in range(IMPORT_ROWS))
+
+    return await client.post('/cars/import', files={'file': ('cars.csv', buffer.getvalue(), 'text/csv')})
+
+
+async def update_car(client: AsyncClient, fleet: Fleet, request: int) -> Response:
+    car_id, number = fleet.updated_car(request)
+    return await client.put(
+        f'/cars/{car_id}', data=fleet.car_form(number), files={'image': ('car.png', fleet.image, 'image/png')}
+    )
+
+
+async def upload_car_image(client: AsyncClient, fleet: Fleet, request: int) -> Response:
+    car_id, _ = fleet.updated_car(request)
+    return await client.put(
+        f'/cars/{car_id}/image',
+        params={'file_name': f'raw{request}.png'},
+        content=fleet.image,
+        headers={'Content-Type': 'image/png'},
+    )
+
+
+async def delete_car(client: AsyncClient, fleet: Fleet, request: int) -> Response:
+    car_id, _ = (fleet.created or fleet.cars).pop()
+    return await client.delete(f'/cars/{car_id}')
+
+
+async def get_batch_cars(client: AsyncClient, fleet: Fleet, request: int) -> Response:
+    return await client.get('/batch-cars', params={'car_ids': fleet.random.sample(fleet.car_ids, BATCH_SIZE)})
+
+
+async def post_cars_batch(client: AsyncClient, fleet: Fleet, request: int) -> Response:
+    return await client.post('/cars/batch', json={'car_ids': fleet.random.sample(fleet.car_ids, BATCH_SIZE)})
+
+
+async def get_station_summary(client: AsyncClient, fleet: Fleet, request: int) -> Response:
+    return await client.get(f'/stations/{fleet.random.randint(1, 50)}/summary')
+
+
+async def list_station_summaries(client: AsyncClient, fleet: Fleet, request: int) -> Response:
+    return await client.get('/stations/summary')
+
+
+async def post_quotes(client: AsyncClient, fleet: Fleet, request: int) -> Response:
+    start = datetime(2024, 6, 1, tzinfo=timezone.utc) + timedelta(hours=fleet.random.randint(0, 24 * 30))
+    windows = [
+        {'start': start.isoformat(), 'end': (start + timedelta(hours=hours)).isoformat()} for hours in QUOTE_HOURS
+    ]
+    return await client.post(
+        '/quotes', json={'car_ids': fleet.random.sample(fleet.car_ids, BATCH_SIZE), 'windows': windows}
+    )
+
+
+async def update_cars_status(client: AsyncClient, fleet: Fleet, request: int) -> Response:
+    status = fleet.random.choice([CarStatuse.free, CarStatuse.repaired])
+    car_ids = fleet.random.sample(fleet.car_ids, BATCH_SIZE)
+    return await client.post('/update-cars-status', json={'status': status, 'car_ids': car_ids})
+
+
+Send = Callable[[AsyncClient, Fleet, int], Awaitable[Response]]
+
+# Route, request sender, expected status and share of `--requests`, in the order they run:
+# reads first, then the writes, and deletes last so they remove the cars created before them
+ROUTES: list[tuple[str, Send, int, float]] = [
+    ('GET /cars', list_cars, 200, 1),
+    ('GET /cars/{car_id}', get_car, 200, 1),
+    ('GET /cars/search', search_cars, 200, 1),
+    ('GET /batch-cars', get_batch_cars, 200, 1),
+    ('POST /cars/batch', post_cars_batch, 200, 1),
+    ('GET /cars/export', export_cars, 200, 0.1),
+    ('GET /stations/{station_id}/summary', get_station_summary, 200, 1),
+    ('GET /stations/summary', list_station_summaries, 200, 1),
+    ('POST /quotes', post_quotes, 200, 1),
+    ('POST /cars', create_car, 200, 1),
+    ('PUT /cars/{car_id}', update_car, 200, 1),
+    ('PUT /cars/{car_id}/image', upload_car_image, 200, 1),
+    ('POST /update-cars-status', update_cars_status, 200, 1),
+    ('POST /cars/import', import_cars, 200, 0.1),
+    ('DELETE /cars/{car_id}', delete_car, 204, 1),
+]
+
+# ASGITransport buffers whole responses, so it cannot read an event stream that never ends
+UNBENCHMARKED_ROUTES = {'GET /cars/events'}
+
+
+def _png_image() -> bytes:
+    buffer = BytesIO()
+    Image.new('RGB', (640, 480), (200, 30, 30)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def uncovered_routes() -> list[str]:
+    routes = [*router.routes, *station_router.routes, *quote_router.routes]
+    served = {f'{method} {route.path}' for route in routes for method in route.methods}
+    return sorted(served - {name for name, *_ in ROUTES} - UNBENCHMARKED_ROUTES)
+
+
+async def run_route(
+    client: AsyncClient, fleet: Fleet, send: Send, expected: int, requests: int, concurrency: int
+) -> dict:
+    latencies = []
+    errors = 0
+    pending = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for request in pending:
+            started = perf_counter()
+            response = await send(client, fleet, request)
+            latencies.append(perf_counter() - started)
+            if response.status_code != expected:
+                errors += 1
+
+    started = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = perf_counter() - started
+
+    percentiles = quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': requests,
+        'errors': errors,
+        'seconds': seconds,
+        'throughput': requests / seconds,
+        'latency_ms': {
+            'p50': percentiles[49] * 1000,
+            'p95': percentiles[94] * 1000,
+            'p99': percentiles[98] * 1000,
+            'max': max(latencies) * 1000,
+        },
+    }
+
+
+async def seed_fleet(size: int) -> list[tuple[int, str]]:
+    async with _async_engine().begin() as connection:
+        await seed(connection, size, stations=50)
+        seeded = Car.number.startswith(SEED_PREFIX)
+        await connection.execute(update(Car).where(seeded).values(image=Car.number + '.png'))
+        cars = await connection.execute(select(Car.id, Car.number).where(seeded).order_by(Car.id))
+        return [tuple(car) for car in cars]
+
+
+async def remove_fleet():
+    async with _async_engine().begin() as connection:
+        await connection.execute(delete(Car).where(Car.number.startswith(SEED_PREFIX)))
+
+
+async def benchmark_fleet(size: int, requests: int, concurrency: int, random_seed: int) -> dict:
+    # Building the app reads the settings, which the embedded Postgres has to set up first
+    from app.main import app
+
+    file_manager = InMemoryFileManager()
+    app.dependency_overrides[get_s3] = lambda: file_manager
+    get_car_cache.cache_clear()
+
+    fleet = Fleet(await seed_fleet(size), Random(random_seed))
+    deletion_worker = DeletionWorker(file_manager)
+    deletion_worker.start()
+    report = {}
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url='http://benchmark') as client:
+            for name, send, expected, share in ROUTES:
+                route_requests = max(1, int(requests * share))
+                report[name] = await run_route(client, fleet, send, expected, route_requests, concurrency)
+    finally:
+        await deletion_worker.stop()
+        await remove_fleet()
+    return report
+
+
+async def main(fleets: list[int], requests: int, concurrency: int, random_seed: int) -> dict:
+    await check_database_revision()
+    await warm_up_pool(concurrency)
+    try:
+        results = {str(size): await benchmark_fleet(size, requests, concurrency, random_seed) for size in fleets}
+    finally:
+        get_image_executor().shutdown(cancel_futures=True)
+        await _async_engine().dispose()
+
+    return {
+        'commit': _current_commit(),
+        'requests': requests,
+        'concurrency': concurrency,
+        'seed': random_seed,
+        'uncovered_routes': uncovered_routes(),
+        'fleets': results,
+    }
+
+
+def start_embedded_postgres(directory: Path):
+    import pgserver
+
+    server = pgserver.get_server(directory, cleanup_mode='stop')
+    if 'car_benchmark' not in server.psql('SELECT datname FROM pg_database;'):
+        server.psql('CREATE DATABASE car_benchmark;')
+    os.environ['DATABASE_URL'] = f'postgresql+asyncpg://postgres@localhost/car_benchmark?host={directory.resolve()}'
+    # S3 is replaced by InMemoryFileManager, the settings only have to be present
+    os.environ.setdefault('AWS_S3_CARS_BUCKET_NAME', 'cars')
+    os.environ.setdefault('AWS_S3_ENDPOINT_URL', 'http://localhost')
+
+    from app.cli import migrate
+
+    migrate('head')
+    return server
+
+
+def _current_commit() -> str | None:
+    commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True)
+    return commit.stdout.strip() or None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fleet', type=int, nargs='+', default=[1000, 10_000], help='numbers of cars to seed')
+    parser.add_argument('--requests', type=int, default=200, help='requests sent to every route')
+    parser.add_argument('--concurrency', type=int, default=16, help='number of requests in flight at once')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the generated requests')
+    parser.add_argument('--output', type=Path, help='also write the JSON report to this file')
+    parser.add_argument('--embedded-postgres', type=Path, help='run against a pgserver instance in this directory')
+    args = parser.parse_args()
+
+    if args.embedded_postgres is not None:
+        server = start_embedded_postgres(args.embedded_postgres)
+
+    report = asyncio.run(main(args.fleet, args.requests, args.concurrency, args.seed))
+
+    serialized = json.dumps(report, indent=2)
+    if args.output is not None:
+        args.output.write_text(serialized + '\n')
+    sys.stdout.write(serialized + '\n')
@@ -0,0 +1,128 @@
+"""Check that a car image uploaded while the deletion worker deletes the same S3 key survives the deletion.
+
+    python -m scripts.deletion_race
+
+The key of the new image is queued for deletion first, as a car that used it before would have left it. The worker
+claims it and is held inside DeleteObjects while the car is created through the API, until the upload of the image
+starts or `HOLD_SECONDS` pass. The upload has to wait for the deletion and land after it, so the created car ends up
+with its image and nothing left queued. The app is served in-process with S3 replaced by InMemoryFileManager, and
+DATABASE_URL must point at a migrated database. The script exits with 1 if the image is gone.
+"""
+
+import asyncio
+import json
+import sys
+from asyncio import create_task, Event, FIRST_COMPLETED, sleep, wait
+
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import delete, insert, select
+
+from scripts.benchmark import _png_image
+
+from app.core.database import _async_engine, managed_session
+from app.core.migrations import check_database_revision
+from app.models.cars import Car
+from app.models.deletions import ObjectDeletion
+from app.storage.deletions import DeletionWorker
+from app.storage.images import create_variants, get_image_executor, variant_keys
+from app.storage.memory import InMemoryFileManager
+from app.storage.s3 import get_s3
+
+NUMBER = 'RACE-0001'
+FILE_NAME = 'car.png'
+KEY = f'{NUMBER}_{FILE_NAME}'
+# Long enough for the create to reach the upload, unless it waits for the worker
+HOLD_SECONDS = 2
+
+
+class HeldFileManager(InMemoryFileManager):
+    """Pauses DeleteObjects until `release` is set, the worker keeps its claimed rows locked meanwhile."""
+
+    def __init__(self):
+        super().__init__()
+        self.deleting = Event()
+        self.uploading = Event()
+        self.release = Event()
+
+    async def upload_file(self, file, file_name: str, content_type: str | None = None) -> bool:
+        if file_name == KEY:
+            self.uploading.set()
+        return await super().upload_file(file, file_name, content_type)
+
+    async def delete_keys(self, keys: list[str]) -> list[str] | None:
+        self.deleting.set()
+        await self.release.wait()
+        return await super().delete_keys(keys)
+
+
+def car_form() -> dict[str, str]:
+    return {
+        'number': NUMBER,
+        'brand': 'bmw',
+        'year': '2020',
+        'status': 'free',
+        'transmission': 'manual',
+        'fuel_type': 'diesel',
+        'color': 'black',
+        'category': 'suv',
+        'engine_capacity': '2',
+        'station_id': '1',
+        'cost_per_hour': '10',
+    }
+
+
+async def cleanup():
+    async with _async_engine().begin() as connection:
+        await connection.execute(delete(Car).where(Car.number == NUMBER))
+        keys = [KEY, *variant_keys(KEY).values()]
+        await connection.execute(delete(ObjectDeletion).where(ObjectDeletion.key.in_(keys)))
+
+
+async def main() -> bool:
+    from app.main import app
+
+    await check_database_revision()
+    await cleanup()
+    # The first rendering spawns the image workers, which would take longer than the hold
+    await create_variants(_png_image())
+
+    file_manager = HeldFileManager()
+    app.dependency_overrides[get_s3] = lambda: file_manager
+
+    async with managed_session() as session:
+        await session.execute(insert(ObjectDeletion).values(key=KEY))
+
+    try:
+        deleting = create_task(DeletionWorker(file_manager).delete_batch())
+        await file_manager.deleting.wait()
+
+        async with AsyncClient(transport=ASGITransport(app=app), base_url='http://race') as client:
+            creating = create_task(
+                client.post('/cars', data=car_form(), files={'image': (FILE_NAME, _png_image(), 'image/png')})
+            )
+            uploading = create_task(file_manager.uploading.wait())
+            await wait([uploading, create_task(sleep(HOLD_SECONDS))], return_when=FIRST_COMPLETED)
+            waited = not uploading.done()
+            file_manager.release.set()
+            await deleting
+            response = await creating
+
+        async with managed_session() as session:
+            queued = list(await session.scalars(select(ObjectDeletion.key).where(ObjectDeletion.key == KEY)))
+    finally:
+        await cleanup()
+        await _async_engine().dispose()
+        get_image_executor().shutdown()
+
+    report = {
+        'status_code': response.status_code,
+        'create_waited_for_deletion': waited,
+        'image_exists': KEY in file_manager.objects,
+        'still_queued': queued,
+    }
+    sys.stdout.write(json.dumps(report, indent=2) + '\n')
+    return response.status_code == 200 and waited and report['image_exists'] and not queued
+
+
+if __name__ == '__main__':
+    sys.exit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,126 @@
+"""Seed a local database with cars and print query plans of the API lookups without and with the car indexes.
+
+    python -m scripts.explain_indexes --rows 200000 --cleanup
+
+The script drops and recreates the indexes declared on `Car`, so point DATABASE_URL at a local database only.
+"""
+
+import argparse
+import asyncio
+import sys
+
+from sqlalchemy import ARRAY, bindparam, delete, select, String, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.api.schemas import CarFilterSchema
+from app.car_app.pagination import paginate
+from app.car_app.repository import filter_conditions
+from app.core.database import _async_engine
+from app.core.enums import Brand, CarSorting, CarStatuse, Category, Color, FuelType, Transmission
+from app.models.cars import Car
+
+SEED_PREFIX = 'SEED-'
+
+SEED_QUERY = text(
+    """
+    INSERT INTO cars (
+        number, brand, transmission, fuel_type, color, category, engine_capacity, year, status, station_id,
+        cost_per_hour
+    )
+    SELECT
+        :prefix || i,
+        (:brands)[1 + floor(random() * cardinality(:brands))::int]::brand,
+        (:transmissions)[1 + floor(random() * cardinality(:transmissions))::int]::transmission,
+        (:fuel_types)[1 + floor(random() * cardinality(:fuel_types))::int]::fueltype,
+        (:colors)[1 + floor(random() * cardinality(:colors))::int]::color,
+        (:categories)[1 + floor(random() * cardinality(:categories))::int]::category,
+        1 + round((random() * 4)::numeric, 1),
+        2000 + floor(random() * 24)::int,
+        (:statuses)[1 + floor(random() * cardinality(:statuses))::int]::carstatuse,
+        1 + floor(random() * :stations)::int,
+        5 + round((random() * 95)::numeric, 2)
+    FROM generate_series(1, :rows) AS i
+    """
+).bindparams(
+    *(
+        bindparam(name, type_=ARRAY(String))
+        for name in ('brands', 'transmissions', 'fuel_types', 'colors', 'categories', 'statuses')
+    )
+)
+
+LOOKUPS = {
+    'cars by status': CarFilterSchema(status=CarStatuse.repaired),
+    'cars at station': CarFilterSchema(station_id=1),
+    'free cars at station in category': CarFilterSchema(station_id=1, status=CarStatuse.free, category=Category.suv),
+}
+
+
+def lookup_queries() -> dict[str, str]:
+    queries = {
+        name: paginate(select(Car).where(*filter_conditions(filters)), CarSorting.id_asc, 50)
+        for name, filters in LOOKUPS.items()
+    }
+    queries['newest cars'] = paginate(select(Car), CarSorting.created_at_desc, 50)
+
+    return {
+        name: str(query.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+        for name, query in queries.items()
+    }
+
+
+async def seed(connection: AsyncConnection, rows: int, stations: int):
+    await connection.execute(
+        SEED_QUERY,
+        {
+            'prefix': SEED_PREFIX,
+            'rows': rows,
+            'stations': stations,
+            'brands': list(Brand),
+            'transmissions': list(Transmission),
+            'fuel_types': list(FuelType),
+            'colors': list(Color),
+            'categories': list(Category),
+            'statuses': list(CarStatuse),
+        },
+    )
+
+
+async def explain(connection: AsyncConnection, title: str):
+    await connection.execute(text('ANALYZE cars'))
+    sys.stdout.write(f'\n===== {title} =====\n')
+    for name, query in lookup_queries().items():
+        plan = await connection.scalars(text(f'EXPLAIN (ANALYZE, BUFFERS) {query}'))
+        sys.stdout.write(f'\n--- {name}\n' + '\n'.join(plan) + '\n')
+
+
+async def main(rows: int, stations: int, cleanup: bool):
+    indexes = Car.__table__.indexes
+
+    async with _async_engine().begin() as connection:
+        for index in indexes:
+            await connection.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+        if rows:
+            await seed(connection, rows, stations)
+
+        await explain(connection, 'without indexes')
+
+        for index in indexes:
+            await connection.run_sync(index.create, checkfirst=True)
+
+        await explain(connection, 'with indexes')
+
+        if cleanup:
+            await connection.execute(delete(Car).where(Car.number.startswith(SEED_PREFIX)))
+
+    await _async_engine().dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100_000, help='number of cars to seed, 0 to reuse existing rows')
+    parser.add_argument('--stations', type=int, default=50, help='number of distinct stations')
+    parser.add_argument('--cleanup', action='store_true', help='delete the seeded cars afterwards')
+    args = parser.parse_args()
+
+    asyncio.run(main(args.rows, args.stations, args.cleanup))
@@ -0,0 +1,140 @@
+"""Seed a local database with described cars and check the latency of car searches against a target.
+
+    python -m scripts.search_benchmark --rows 100000 --queries 500 --target-ms 50 --cleanup
+
+Searches go through `CarRepository.search` one at a time: plate fragments, description words with a typo, and both
+combined with filters. The plan of one search of every kind is printed, so a missing trigram index shows up as a
+sequential scan. The script exits with 1 if the p95 latency of any kind is above `--target-ms`. It needs a database with
+the pg_trgm extension, the ILIKE fallback used without it is not what this measures.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from random import Random
+from statistics import quantiles
+from time import perf_counter
+
+from sqlalchemy import ARRAY, bindparam, delete, select, String, text
+
+from scripts.explain_indexes import seed, SEED_PREFIX
+
+from app.api.schemas import CarFilterSchema
+from app.car_app.cache import get_car_cache
+from app.car_app.pagination import paginate_search
+from app.car_app.repository import CAR_COLUMNS, CarRepository, filter_conditions, search_condition, search_rank
+from app.core.database import _async_engine, has_extension, managed_session
+from app.core.enums import Brand, CarStatuse
+from app.models.cars import Car
+
+WORDS = (
+    'automatic leather sunroof navigation heated seats panoramic parking sensors camera bluetooth cruise control '
+    'diesel hybrid electric compact spacious family sporty economical convertible towbar winter tyres child seat '
+    'roof rack premium sound system keyless entry adaptive headlights lane assist climate cargo'
+).split()
+
+DESCRIBE_QUERY = text(
+    """
+    UPDATE cars
+    SET description = (
+        SELECT string_agg((:words)[1 + floor(random() * cardinality(:words))::int], ' ')
+        FROM generate_series(1, 4 + cars.id % 8)
+    )
+    WHERE number LIKE :prefix || '%'
+    """
+).bindparams(bindparam('words', type_=ARRAY(String)))
+
+
+def misspell(word: str, random: Random) -> str:
+    position = random.randrange(1, len(word) - 1)
+    return word[:position] + word[position + 1] + word[position] + word[position + 2 :]
+
+
+def searches(numbers: list[str], random: Random) -> dict[str, tuple[str, CarFilterSchema]]:
+    number = random.choice(numbers)
+    return {
+        'plate fragment': (number[-4:], CarFilterSchema()),
+        'misspelled word': (misspell(random.choice(WORDS), random), CarFilterSchema()),
+        'two words': (' '.join(random.sample(WORDS, 2)), CarFilterSchema()),
+        'word with filters': (
+            random.choice(WORDS),
+            CarFilterSchema(brand=random.choice(list(Brand)), status=CarStatuse.free),
+        ),
+    }
+
+
+async def explain(q: str, filters: CarFilterSchema, limit: int):
+    rank = search_rank(q)
+    query = paginate_search(
+        select(*CAR_COLUMNS, rank.label('rank')).where(search_condition(q), *filter_conditions(filters)),
+        rank,
+        q,
+        limit,
+    )
+    async with _async_engine().connect() as connection:
+        compiled = query.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True})
+        plan = await connection.exec_driver_sql(f'EXPLAIN (ANALYZE, BUFFERS) {compiled}')
+        sys.stdout.write('\n'.join(plan.scalars()) + '\n')
+
+
+async def main(rows: int, queries: int, limit: int, target_ms: float, random_seed: int, cleanup: bool) -> bool:
+    random = Random(random_seed)
+    seeded = Car.number.startswith(SEED_PREFIX)
+
+    async with managed_session() as session:
+        if not await has_extension(session, 'pg_trgm'):
+            raise SystemExit('pg_trgm is not installed in the database, migration 19fdacf54828 tells how to add it')
+
+    async with _async_engine().begin() as connection:
+        if rows:
+            await seed(connection, rows, stations=50)
+            await connection.execute(DESCRIBE_QUERY, {'words': WORDS, 'prefix': SEED_PREFIX})
+        await connection.execute(text('ANALYZE cars'))
+        numbers = list(await connection.scalars(select(Car.number).where(seeded)))
+
+    try:
+        for kind, (q, filters) in searches(numbers, random).items():
+            sys.stdout.write(f'\n--- {kind}: {q!r}\n')
+            await explain(q, filters, limit)
+
+        latencies = {kind: [] for kind in searches(numbers, random)}
+        for _ in range(queries):
+            for kind, (q, filters) in searches(numbers, random).items():
+                async with managed_session(read_only=True) as session:
+                    repository = CarRepository(session, get_car_cache(), session)
+                    started = perf_counter()
+                    await repository.search(q, filters, limit)
+                    latencies[kind].append(perf_counter() - started)
+    finally:
+        if cleanup:
+            async with _async_engine().begin() as connection:
+                await connection.execute(delete(Car).where(seeded))
+        await _async_engine().dispose()
+
+    report = {}
+    for kind, values in latencies.items():
+        percentiles = quantiles(values, n=100, method='inclusive') if len(values) > 1 else values * 99
+        report[kind] = {
+            'p50': percentiles[49] * 1000,
+            'p95': percentiles[94] * 1000,
+            'p99': percentiles[98] * 1000,
+        }
+    sys.stdout.write('\n' + json.dumps({'rows': len(numbers), 'target_ms': target_ms, 'latency_ms': report}, indent=2))
+    sys.stdout.write('\n')
+
+    return all(latency['p95'] <= target_ms for latency in report.values())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100_000, help='number of cars to seed, 0 to reuse seeded rows')
+    parser.add_argument('--queries', type=int, default=200, help='searches of every kind')
+    parser.add_argument('--limit', type=int, default=20, help='page size of a search')
+    parser.add_argument('--target-ms', type=float, default=50, help='p95 latency every kind of search must meet')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the searches')
+    parser.add_argument('--cleanup', action='store_true', help='delete the seeded cars afterwards')
+    args = parser.parse_args()
+
+    met = asyncio.run(main(args.rows, args.queries, args.limit, args.target_ms, args.seed, args.cleanup))
+    sys.exit(0 if met else 1)
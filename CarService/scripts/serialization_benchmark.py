@@ -0,0 +1,101 @@
+"""Compare rows per second of the ORM + validation read path with the row mapping + orjson one, as JSON.
+
+    python -m scripts.serialization_benchmark --rows 10000 --runs 5
+
+Cars are seeded inside a transaction that is rolled back at the end, so the database is left as it was.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+from typing import Awaitable, Callable
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from scripts.explain_indexes import seed, SEED_PREFIX
+
+from app.api.schemas import CarSchema
+from app.car_app.repository import CAR_COLUMNS, car_from_row
+from app.core.database import _async_engine
+from app.models.cars import Car
+
+RESPONSE_FIELD = create_response_field('response', list[CarSchema])
+
+
+async def validated_path(session: AsyncSession, car_ids: list[int]) -> bytes:
+    """ORM objects validated into schemas, then validated and encoded once more by FastAPI as `response_model`."""
+    cars = [CarSchema.model_validate(car) for car in await session.scalars(select(Car).where(Car.id.in_(car_ids)))]
+    content = await serialize_response(field=RESPONSE_FIELD, response_content=cars)
+    return JSONResponse(content).body
+
+
+async def fast_path(session: AsyncSession, car_ids: list[int]) -> bytes:
+    """Plain rows built into schemas without validation and encoded by orjson."""
+    cars = [car_from_row(row) for row in await session.execute(select(*CAR_COLUMNS).where(Car.id.in_(car_ids)))]
+    return ORJSONResponse([car.model_dump() for car in cars]).body
+
+
+async def measure(
+    session: AsyncSession, path: Callable[[AsyncSession, list[int]], Awaitable[bytes]], car_ids: list[int], runs: int
+) -> dict[str, float]:
+    await path(session, car_ids)
+
+    timings = []
+    for _ in range(runs):
+        # Identity map hits would make the ORM path look cheaper than it is for a fresh request session
+        session.expunge_all()
+        started = perf_counter()
+        await path(session, car_ids)
+        timings.append(perf_counter() - started)
+
+    return {
+        'seconds_median': median(timings),
+        'seconds_min': min(timings),
+        'rows_per_second': len(car_ids) / median(timings),
+    }
+
+
+async def main(rows: int, runs: int, output: Path | None):
+    async with _async_engine().connect() as connection:
+        transaction = await connection.begin()
+        await seed(connection, rows, stations=50)
+        session = AsyncSession(bind=connection)
+
+        car_ids = list(await session.scalars(select(Car.id).where(Car.number.startswith(SEED_PREFIX))))
+        validated = await measure(session, validated_path, car_ids, runs)
+        fast = await measure(session, fast_path, car_ids, runs)
+
+        await session.close()
+        await transaction.rollback()
+    await _async_engine().dispose()
+
+    report = {
+        'rows': len(car_ids),
+        'runs': runs,
+        'validated': validated,
+        'fast': fast,
+        'speedup': fast['rows_per_second'] / validated['rows_per_second'],
+    }
+
+    serialized = json.dumps(report, indent=2)
+    if output is not None:
+        output.write_text(serialized + '\n')
+    sys.stdout.write(serialized + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10_000, help='number of cars to seed and read')
+    parser.add_argument('--runs', type=int, default=5, help='number of measured reads of every path')
+    parser.add_argument('--output', type=Path, help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    asyncio.run(main(args.rows, args.runs, args.output))
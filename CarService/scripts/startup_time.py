@@ -0,0 +1,78 @@
+"""Measure how long a worker takes to import the app and run its lifespan startup, as JSON for CI to compare.
+
+    python -m scripts.startup_time --runs 5 --output startup.json
+
+Every run happens in a fresh interpreter, so import caches of earlier runs do not hide the cost.
+"""
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+
+PHASES = ('import_seconds', 'startup_seconds', 'shutdown_seconds')
+
+
+async def measure_lifespan(app) -> tuple[float, float]:
+    lifespan = app.router.lifespan_context(app)
+
+    started = perf_counter()
+    await lifespan.__aenter__()
+    startup = perf_counter() - started
+
+    started = perf_counter()
+    await lifespan.__aexit__(None, None, None)
+    return startup, perf_counter() - started
+
+
+def measure_once() -> dict[str, float]:
+    started = perf_counter()
+    from app.main import app
+
+    import_seconds = perf_counter() - started
+
+    startup_seconds, shutdown_seconds = asyncio.run(measure_lifespan(app))
+    return dict(zip(PHASES, (import_seconds, startup_seconds, shutdown_seconds)))
+
+
+def main(runs: int, output: Path | None):
+    samples = []
+    for _ in range(runs):
+        child = subprocess.run(
+            [sys.executable, '-m', 'scripts.startup_time', '--child'], capture_output=True, text=True, check=True
+        )
+        samples.append(json.loads(child.stdout.splitlines()[-1]))
+
+    report = {
+        'runs': runs,
+        **{
+            phase: {
+                'median': median(sample[phase] for sample in samples),
+                'min': min(sample[phase] for sample in samples),
+                'max': max(sample[phase] for sample in samples),
+            }
+            for phase in PHASES
+        },
+    }
+
+    serialized = json.dumps(report, indent=2)
+    if output is not None:
+        output.write_text(serialized + '\n')
+    sys.stdout.write(serialized + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='number of fresh interpreters to measure')
+    parser.add_argument('--output', type=Path, help='also write the JSON report to this file')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.stdout.write(json.dumps(measure_once()) + '\n')
+    else:
+        main(args.runs, args.output)